@@ -0,0 +1,131 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+TIME_PASSED = 'time_passed'
+TRACE_POSITION = 'trace_position'
+TIME_SINCE_LAST = 'time_since_last'
+TRACE_LENGTH = 'trace_length'
+TRACE_DURATION = 'trace_duration'
+
+
+def to_milliseconds(values: pd.Series) -> np.ndarray:
+    """
+    Convert timestamps to milliseconds. Only differences of the result are meaningful.
+    Numeric values are assumed to be given in milliseconds already.
+    :param values: timestamps as datetimes or numbers
+    :return: float array with missing values as NaN
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values)
+    return ((values - values.min()) / np.timedelta64(1, 'ms')).to_numpy(dtype=float, na_value=np.nan)
+
+
+def durations_to_milliseconds(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_timedelta64_dtype(values):
+        values = values / np.timedelta64(1, 'ms')
+    return values.to_numpy(dtype=float, na_value=np.nan)
+
+
+class DerivationContext:
+    """
+    Shared intermediate results for computing derived attributes of all events in one pass.
+    All arrays are aligned with the rows of the case-sorted event frame; events without a case are at the end
+    of the frame and are assigned NaN.
+    """
+
+    def __init__(self, df: pd.DataFrame, offsets: np.ndarray, timestamp_attr: str, duration_attr: str):
+        self.df = df
+        self.offsets = offsets
+        self.ts_attr = timestamp_attr
+        self.duration_attr = duration_attr
+        self.starts = offsets[:-1]
+        self.ends = offsets[1:]
+        self.lengths = np.diff(offsets)
+        self._timestamps: Optional[np.ndarray] = None
+        self._durations: Optional[np.ndarray] = None
+
+    @property
+    def n_traced(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        if self._timestamps is None:
+            self._timestamps = to_milliseconds(self.df[self.ts_attr])[:self.n_traced]
+        return self._timestamps
+
+    @property
+    def durations(self) -> np.ndarray:
+        if self._durations is None:
+            if self.duration_attr in self.df:
+                self._durations = durations_to_milliseconds(self.df[self.duration_attr])[:self.n_traced]
+            else:
+                self._durations = np.zeros(self.n_traced)
+        return self._durations
+
+    def per_case(self, values: np.ndarray) -> np.ndarray:
+        """
+        Broadcast one value per case to all events of the case.
+        """
+        return np.repeat(values, self.lengths)
+
+    def to_column(self, values: np.ndarray) -> np.ndarray:
+        """
+        Pad values of the traced events to the full length of the frame.
+        """
+        n_missing = len(self.df) - self.n_traced
+        if n_missing == 0:
+            return values
+        return np.concatenate((values.astype(float), np.full(n_missing, np.nan)))
+
+
+DerivedAttrFn = Callable[[DerivationContext], np.ndarray]
+
+
+def time_passed(ctx: DerivationContext) -> np.ndarray:
+    """ Milliseconds since the first event of the case """
+    return ctx.timestamps - ctx.per_case(ctx.timestamps[ctx.starts])
+
+
+def trace_position(ctx: DerivationContext) -> np.ndarray:
+    """ Zero-based position of the event within its case """
+    return np.arange(ctx.n_traced) - ctx.per_case(ctx.starts)
+
+
+def time_since_last(ctx: DerivationContext) -> np.ndarray:
+    """ Milliseconds since the previous event of the same case (0 for the first event) """
+    gaps = np.diff(ctx.timestamps, prepend=np.nan)
+    gaps[ctx.starts[ctx.lengths > 0]] = 0.
+    return gaps
+
+
+def trace_length(ctx: DerivationContext) -> np.ndarray:
+    """ Number of events in the case """
+    return ctx.per_case(ctx.lengths)
+
+
+def case_durations(ctx: DerivationContext) -> np.ndarray:
+    """
+    Duration of every case in milliseconds, i.e. the time from its first event until the last event finished.
+    """
+    last = ctx.ends - 1
+    return ctx.timestamps[last] - ctx.timestamps[ctx.starts] + np.nan_to_num(ctx.durations[last])
+
+
+def trace_duration(ctx: DerivationContext) -> np.ndarray:
+    """ Duration of the case in milliseconds """
+    return ctx.per_case(case_durations(ctx))
+
+
+DEFAULT_DERIVED_ATTRS: Dict[str, DerivedAttrFn] = OrderedDict([
+    (TIME_PASSED, time_passed),
+    (TRACE_POSITION, trace_position),
+    (TIME_SINCE_LAST, time_since_last),
+    (TRACE_LENGTH, trace_length),
+    (TRACE_DURATION, trace_duration),
+])
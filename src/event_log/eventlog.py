@@ -1,9 +1,14 @@
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Callable, List, Union
+from typing import Optional, Dict, Callable, List, Union, Tuple
 
 import pandas as pd
 import numpy as np
+from src.event_log import derived
 from src.event_log.trace import Trace
+from src.event_log.variants import TraceVariants
+from src.event_log.vocabulary import Vocabulary
+from src.utils import io
 
 import streamlit as st
 
@@ -13,63 +18,311 @@ import streamlit as st
 # visitID -> Case ID
 class EventLog:
     def __init__(self, df: Optional[pd.DataFrame], case_id_attr='visitId', activity_attr='Activity',
-                 timestamp_attr='Timestamp', duration_attr='Duration', ts_parse_params: Optional[Dict] = None, **kwargs):
-        self._df = df
+                 timestamp_attr='Timestamp', duration_attr='Duration', ts_parse_params: Optional[Dict] = None,
+                 categorical_attrs: Optional[List[str]] = None, **kwargs):
+        """
+        :param categorical_attrs: attributes stored dictionary encoded in addition to case id and activity,
+        defaults to all string attributes
+        """
         self.case_id_attr = case_id_attr
         self.activity_attr = activity_attr
         self.ts_attr = timestamp_attr
         self.duration_attr = duration_attr
-        self.time_passed_attr = 'time_passed'
+        self.time_passed_attr = derived.TIME_PASSED
+        self.trace_duration_attr = derived.TRACE_DURATION
         self._ts_parse_params = ts_parse_params
         if ts_parse_params is not None:
-            self._df.loc[:, self.ts_attr] = pd.to_datetime(self._df[self.ts_attr], **ts_parse_params)
+            df = df.assign(**{self.ts_attr: pd.to_datetime(df[self.ts_attr], **ts_parse_params)})
+        if categorical_attrs is None:
+            categorical_attrs = list(df.select_dtypes(include=['object', 'string']).columns)
+        encoded = [a for a in OrderedDict.fromkeys([case_id_attr, activity_attr] + categorical_attrs)
+                   if a in df and not isinstance(df[a].dtype, pd.CategoricalDtype)]
+        if encoded:
+            df = df.astype({a: 'category' for a in encoded})
 
-        log_attrs = {
+        self._trace_attrs = {
             'activity_attr': activity_attr,
             'case_id_attr': case_id_attr,
             'timestamp_attr': timestamp_attr,
-            'duration_attr': self.duration_attr
+            'duration_attr': self.duration_attr,
+            'trace_duration_attr': self.trace_duration_attr
         }
-        self.traces = df.groupby(self.case_id_attr).apply(Trace, attrs=log_attrs)  # TODO implement more performant alternative
-        self.determine_trace_duration()
+        # keep events of a case contiguous and in chronological order, all derived attributes rely on it
+        # (stable sort retains the file order of events with equal timestamps)
+        sort_keys = [self.case_id_attr] + ([self.ts_attr] if self.ts_attr in df else [])
+        self._df = df.sort_values(sort_keys, kind='mergesort')
+        offsets, case_ids = self._build_trace_index()
+        self._offsets = offsets
+        self._case_index = pd.Index(case_ids, name=self.case_id_attr)  # hash-based lookup of case id -> ordinal
+        self._vocabulary = Vocabulary.from_frame(self._df)
+        self._traces: Optional[pd.Series] = None
+        self._variants: Optional[TraceVariants] = None
+        self._event_cases: Optional[np.ndarray] = None
+        self._case_features: Optional[pd.DataFrame] = None
+        self._derived_attrs: Dict[str, derived.DerivedAttrFn] = OrderedDict(derived.DEFAULT_DERIVED_ATTRS)
+        self.compute_derived_attrs()
+
+    def _build_trace_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Determine the boundaries of the cases within the case-sorted frame.
+        :return: tuple with the offsets (events of the i-th case are at `offsets[i]:offsets[i + 1]`) and the case ids
+        """
+        case_col = self._df[self.case_id_attr]
+        n_valid = int(case_col.notna().sum())  # missing case ids are sorted to the end and don't form a trace
+        keys = case_col.cat.codes.to_numpy()[:n_valid]
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        offsets = np.concatenate(([0], boundaries, [n_valid])) if n_valid else np.zeros(1, dtype=int)
+        return offsets.astype(np.int64), case_col.cat.categories[keys[offsets[:-1]]]
+
+    @property
+    def _root(self) -> 'EventLog':
+        """
+        The log holding the event frame which filtered views refer to.
+        """
+        return self
+
+    def _to_root_rows(self, positions: np.ndarray) -> np.ndarray:
+        return positions
+
+    @property
+    def _event_index(self) -> pd.Index:
+        return self._df.index
+
+    def get_column(self, attr: str) -> pd.Series:
+        """
+        Values of an attribute for all events (in the case-sorted order of the log)
+        """
+        return self._df[attr]
+
+    @property
+    def vocabulary(self) -> Vocabulary:
+        """
+        Dictionaries of the encoded attributes (case id, activity and string attributes)
+        """
+        return self._vocabulary
+
+    def get_codes(self, attr: str) -> np.ndarray:
+        """
+        Integer codes of a dictionary encoded attribute for all events, -1 for missing values.
+        Use `vocabulary.decode` to get the values back.
+        """
+        return self.get_column(attr).cat.codes.to_numpy()
+
+    def get_event_case_ordinals(self) -> np.ndarray:
+        """
+        Ordinal of the case of every event, -1 for events without case.
+        """
+        if self._event_cases is None:
+            self._event_cases = np.full(len(self), -1, dtype=np.int64)
+            self._event_cases[:self._offsets[-1]] = np.repeat(np.arange(len(self._case_index)), self.case_lengths)
+        return self._event_cases
+
+    @property
+    def case_lengths(self) -> np.ndarray:
+        """
+        Number of events of every case in the order of the case ordinals.
+        """
+        return np.diff(self._offsets)
+
+    @property
+    def case_features(self) -> pd.DataFrame:
+        """
+        Features of every case computed in one aggregation pass (durations and time span in ms):
+        events, total_duration, mean_duration, span, distinct_activities, start_activity, end_activity and
+        events_per_second (over the span of the case, NaN for cases without span).
+        """
+        if self._case_features is None:
+            n_traced = self._offsets[-1]
+            has_durations = self.duration_attr in self._event_columns
+            events = pd.DataFrame({
+                'case': self.get_event_case_ordinals()[:n_traced],
+                'activity': self.get_codes(self.activity_attr)[:n_traced],
+                'duration': derived.durations_to_milliseconds(self.get_column(self.duration_attr))[:n_traced]
+                if has_durations else np.zeros(n_traced),
+                'timestamp': derived.to_milliseconds(self.get_column(self.ts_attr))[:n_traced],
+            })
+            features = events.groupby('case', sort=False).agg(
+                events=('activity', 'size'),
+                total_duration=('duration', 'sum'),
+                mean_duration=('duration', 'mean'),
+                first_timestamp=('timestamp', 'min'),
+                last_timestamp=('timestamp', 'max'),
+                distinct_activities=('activity', 'nunique'),
+                start_activity=('activity', 'first'),
+                end_activity=('activity', 'last'),
+            )
+            span = (features['last_timestamp'] - features['first_timestamp']).to_numpy()
+            activities = self.vocabulary[self.activity_attr]
+            no_durations = np.full(len(features), np.nan)
+            self._case_features = pd.DataFrame({
+                'events': features['events'].to_numpy(),
+                'total_duration': features['total_duration'].to_numpy() if has_durations else no_durations,
+                'mean_duration': features['mean_duration'].to_numpy() if has_durations else no_durations,
+                'span': span,
+                'distinct_activities': features['distinct_activities'].to_numpy(),
+                'start_activity': pd.Categorical.from_codes(features['start_activity'].to_numpy(), activities),
+                'end_activity': pd.Categorical.from_codes(features['end_activity'].to_numpy(), activities),
+                'events_per_second': features['events'].to_numpy() / np.where(span > 0, span / 1000, np.nan),
+            }, index=self.case_index)
+        return self._case_features
+
+    @property
+    def _event_columns(self) -> pd.Index:
+        return self._df.columns
+
+    def _create_trace(self, idx: int) -> Trace:
+        return Trace(self._df, self._trace_attrs, self._offsets[idx], self._offsets[idx + 1])
+
+    @property
+    def traces(self) -> pd.Series:
+        """
+        Series of all traces indexed by their case id. The traces are views on the event frame of the log.
+        """
+        if self._traces is None:
+            self._traces = self._create_traces(np.arange(len(self._case_index)))
+        return self._traces
+
+    def _create_traces(self, ordinals: np.ndarray) -> pd.Series:
+        views = np.empty(len(ordinals), dtype=object)
+        for i, idx in enumerate(ordinals):
+            views[i] = self._create_trace(idx)
+        return pd.Series(views, index=self._case_index[ordinals], dtype=object)
+
+    @property
+    def variants(self) -> TraceVariants:
+        """
+        Unique activity sequences of the log with their counts and the mapping of cases to variants.
+        """
+        if self._variants is None:
+            activities = self.get_column(self.activity_attr).iloc[:self._offsets[-1]]
+            self._variants = TraceVariants.from_activities(activities, self._offsets)
+        return self._variants
+
+    def get_variant_traces(self) -> pd.Series:
+        """
+        One representative trace (the first case) per variant, in the order of the variants.
+        Use `variants.counts` as weights and `variants.broadcast` to map per variant results back to the cases.
+        """
+        return self._create_traces(self.variants.representatives)
 
     @classmethod
-    def read_from(cls, path: Path, **kwargs):
-        if path.suffix == '.csv':
-            df = pd.read_csv(path, sep=',')
-            return cls(df, **kwargs)
-        else:
-            raise NotImplementedError(f"Extension '{path.suffix}' is not recognized")
+    def read_from(cls, path: Path, columns: Optional[List[str]] = None, **kwargs):
+        """
+        Create an event log from a csv or parquet file.
+        :param path: file to read
+        :param columns: columns to read, defaults to all
+        """
+        df = io.read_data_file(path, columns)
+        return cls(df, **kwargs)
 
     def __iter__(self):
-        for t in self.traces:
-            yield t
+        for i in range(len(self._case_index)):
+            yield self._create_trace(i)
 
     def get_unique_activities(self):
-        return self._df[self.activity_attr].unique()
+        return self.get_column(self.activity_attr).unique()
 
     def get_case_ids(self):
-        return self._df[self.case_id_attr]
+        return self.get_column(self.case_id_attr)
 
     def __len__(self):
         return len(self._df)
 
-    def __getitem__(self, mask):
-        df = self._df[mask]
-        return EventLog(df, self.case_id_attr, self.activity_attr, self.ts_attr, self._ts_parse_params)
+    def __getitem__(self, mask) -> 'EventLogView':
+        return self.filter_events(mask)
+
+    def filter_events(self, mask) -> 'EventLogView':
+        """
+        Select events without copying them. Filters can be chained, e.g. `log[mask_a][mask_b]`.
+        :param mask: boolean mask over the events (array or series aligned with the event frame), integer positions
+        of the events or a function returning either of them for the log
+        :return: lazily evaluated view on the selected events
+        """
+        if callable(mask):
+            mask = mask(self)
+        if isinstance(mask, pd.Series) and pd.api.types.is_bool_dtype(mask):
+            if not mask.index.equals(self._event_index):
+                mask = mask.reindex(self._event_index, fill_value=False)
+            mask = mask.to_numpy(dtype=bool)
+        mask = np.asarray(mask)
+        positions = np.flatnonzero(mask) if mask.dtype == bool else np.unique(mask)
+        return EventLogView(self, positions)
 
-    def get_trace(self, case_id: str) -> Trace:
+    def filter_cases(self, selection) -> 'EventLogView':
+        """
+        Select whole cases without copying their events, e.g. `log.filter_cases(log.case_lengths > 1)`.
+        :param selection: boolean mask over the cases (in the order of the case ordinals) or collection of case ids
+        :return: lazily evaluated view on the events of the selected cases
+        """
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            ordinals = np.flatnonzero(selection)
+        else:
+            ordinals = np.unique(self.get_case_ordinals(selection))
+            ordinals = ordinals[ordinals >= 0]
+        lengths = self.case_lengths[ordinals]
+        view_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(self._offsets[ordinals] - view_starts, lengths) + np.arange(lengths.sum())
+        return EventLogView(self, positions)
+
+    @property
+    def case_index(self) -> pd.Index:
+        """
+        Ids of all cases in the order of their ordinals (position of the case within the log).
+        """
+        return self._case_index
+
+    def get_case_ordinal(self, case_id) -> int:
+        """
+        Position of a case within the log.
+        :raises ValueError: if there is no case with the given id
+        """
         try:
-            trace = next(t for t in self.traces if t.id == case_id)
-            return trace
-        except StopIteration:
-            ValueError(f"No case with id '{case_id}' found!")
+            return self._case_index.get_loc(case_id)
+        except KeyError:
+            raise ValueError(f"No case with id '{case_id}' found!") from None
+
+    def get_case_ordinals(self, case_ids) -> np.ndarray:
+        """
+        Batched version of `get_case_ordinal`.
+        :param case_ids: collection of case ids
+        :return: array with the position of every case, -1 for unknown ids
+        """
+        return self._case_index.get_indexer(case_ids)
+
+    def get_case_id(self, ordinal: int):
+        return self._case_index[ordinal]
+
+    def get_trace(self, case_id) -> Trace:
+        return self._create_trace(self.get_case_ordinal(case_id))
+
+    def get_traces_by_ids(self, case_ids) -> pd.Series:
+        """
+        Look up the traces of many cases at once.
+        :param case_ids: collection of case ids
+        :return: series of the traces indexed by their case ids
+        :raises ValueError: if any of the case ids is unknown
+        """
+        ordinals = self.get_case_ordinals(case_ids)
+        if (ordinals < 0).any():
+            missing = [c for c, o in zip(case_ids, ordinals) if o < 0]
+            raise ValueError(f"No cases with ids {missing} found!")
+        return self._create_traces(ordinals)
+
+    def get_case_events(self, case_id) -> pd.DataFrame:
+        """
+        All events belonging to the given case.
+        :raises ValueError: if there is no case with the given id
+        """
+        idx = self.get_case_ordinal(case_id)
+        return self._df.iloc[self._offsets[idx]:self._offsets[idx + 1]]
 
     def get_traces(self, filter_fn: Optional[Callable] = None) -> pd.Series:
         """
         Returns a series of all traces matching the predicate (if given).
         :param filter_fn: predicate function for filtering the return traces
         E.g. to select only the traces with at least 2 activities the predicate `lambda traces: traces.str.len() >= 2` can be used
+        Prefer `filter_cases` for selecting traces, which neither creates nor evaluates the trace objects.
         :return: collection of traces meeting the criteria
         """
         if filter_fn:
@@ -77,24 +330,131 @@ class EventLog:
         else:
             return self.traces
 
-    def _get_time_since_tracestart(self, row):
-        t = self.traces[row[self.case_id_attr]]
-        td = t.get_time_passed(row[self.ts_attr])
-        return td / np.timedelta64(1, 'ms')
+    def compute_derived_attrs(self, names: Optional[List[str]] = None) -> None:
+        """
+        (Re-)compute derived attributes of all events in one vectorized pass and store them as columns.
+        :param names: derived attributes to compute, defaults to all registered ones
+        """
+        ctx = derived.DerivationContext(self._df, self._offsets, self.ts_attr, self.duration_attr)
+        for name in names if names is not None else self._derived_attrs:
+            self._df[name] = ctx.to_column(self._derived_attrs[name](ctx))
 
-    def determine_trace_duration(self) -> None:
-        self._df[self.time_passed_attr] = self._df.apply(self._get_time_since_tracestart, axis=1)
-        # self._df[self.duration_attr] = self.traces[self._df[self.case_id_attr]].get_time_passed(self._df[self.ts_attr])
+    def register_derived_attr(self, name: str, fn: derived.DerivedAttrFn) -> None:
+        """
+        Add a derived attribute which is computed from the case-sorted events, e.g.
+        `log.register_derived_attr('is_last', lambda ctx: derived.trace_position(ctx) == ctx.per_case(ctx.lengths - 1))`
+        :param name: name of the resulting column
+        :param fn: function mapping a `DerivationContext` to an array with one value per traced event
+        """
+        self._derived_attrs[name] = fn
+        self.compute_derived_attrs([name])
 
     def set_clusters(self, cluster_map: Dict) -> None:
         """
         Tags each trace with a cluster number
         :param cluster_map: dict mapping the visitId to a cluster number
         """
-        self._df['cluster'] = self._df[self.case_id_attr].map(cluster_map)
+        case_clusters = pd.Series(cluster_map, dtype=float).reindex(self._case_index).to_numpy()
+        case_ordinals = self.get_event_case_ordinals()
+        self._df['cluster'] = np.where(case_ordinals >= 0, case_clusters[case_ordinals], np.nan)
 
     def shatter(self, by: str) -> List:
         pass
 
     def export_to_csv(self, dest_file: Union[Path, str]) -> None:
         self._df.to_csv(dest_file, index=False)
+
+    def export_to_parquet(self, dest_file: Union[Path, str]) -> None:
+        """
+        Store the log in the columnar parquet format with dictionary encoded string columns (e.g. case id, activity)
+        and native timestamps.
+        """
+        io.write_parquet(self._df, dest_file)
+
+    def export(self, dest_file: Union[Path, str]) -> None:
+        """
+        Store the log in the format given by the extension of the destination file.
+        """
+        if Path(dest_file).suffix == '.parquet':
+            self.export_to_parquet(dest_file)
+        else:
+            self.export_to_csv(dest_file)
+
+
+class EventLogView(EventLog):
+    """
+    Lazily filtered view on an event log.
+    The view only stores the positions of the selected events within the original log. Case lookups are derived from
+    the original log; the events and their derived attributes are only materialized when they are actually read
+    (e.g. traces, exports). Filtering a view yields another view on the original log.
+    """
+
+    def __init__(self, parent: EventLog, positions: np.ndarray):
+        self._source = parent._root
+        self._rows = parent._to_root_rows(positions)
+        self.case_id_attr = parent.case_id_attr
+        self.activity_attr = parent.activity_attr
+        self.ts_attr = parent.ts_attr
+        self.duration_attr = parent.duration_attr
+        self.time_passed_attr = parent.time_passed_attr
+        self.trace_duration_attr = parent.trace_duration_attr
+        self._ts_parse_params = parent._ts_parse_params
+        self._trace_attrs = parent._trace_attrs
+        self._vocabulary = parent.vocabulary
+        self._derived_attrs = OrderedDict(parent._derived_attrs)
+        self._traces = None
+        self._variants = None
+        self._event_cases = None
+        self._case_features = None
+        self._frame: Optional[pd.DataFrame] = None
+        self._trace_index: Optional[Tuple[np.ndarray, pd.Index]] = None
+
+    @property
+    def _root(self) -> EventLog:
+        return self._source
+
+    def _to_root_rows(self, positions: np.ndarray) -> np.ndarray:
+        return self._rows[positions]
+
+    @property
+    def _df(self) -> pd.DataFrame:
+        if self._frame is None:
+            self._frame = self._source._df.iloc[self._rows].copy()
+            self.compute_derived_attrs()
+        return self._frame
+
+    def _build_trace_index(self) -> Tuple[np.ndarray, pd.Index]:
+        # the selected rows keep the case-sorted order of the original log
+        keys = self._source.get_event_case_ordinals()[self._rows]
+        keys = keys[:int((keys >= 0).sum())]
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        offsets = np.concatenate(([0], boundaries, [len(keys)])) if len(keys) else np.zeros(1, dtype=int)
+        return offsets.astype(np.int64), self._source.case_index[keys[offsets[:-1]]]
+
+    @property
+    def _offsets(self) -> np.ndarray:
+        if self._trace_index is None:
+            self._trace_index = self._build_trace_index()
+        return self._trace_index[0]
+
+    @property
+    def _case_index(self) -> pd.Index:
+        if self._trace_index is None:
+            self._trace_index = self._build_trace_index()
+        return self._trace_index[1]
+
+    @property
+    def _event_index(self) -> pd.Index:
+        return self._source._event_index[self._rows]
+
+    @property
+    def _event_columns(self) -> pd.Index:
+        return self._source._event_columns
+
+    def get_column(self, attr: str) -> pd.Series:
+        if self._frame is not None or attr in self._derived_attrs:
+            return self._df[attr]
+        return self._source.get_column(attr).iloc[self._rows]
+
+    def __len__(self):
+        return len(self._rows)
@@ -1,38 +1,207 @@
-import datetime
+import gzip
+import mmap
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
-
-
-class XesReader():
-    def __init__(self):
-        pass
-
-    def read(self, xes_file: Path) -> List:
-        # tree = ET.parse('financial_log.xes')
-        tree = ET.parse(xes_file)
-        root = tree.getroot()
-
-        ns = {'xes': 'http://www.xes-standard.org/'}
-        for trace in root.findall('xes:trace', ns):
-            caseid = ''
-            for string in trace.findall('xes:string', ns):
-                if string.attrib['key'] == 'concept:name':
-                    caseid = string.attrib['value']
-            for event in trace.findall('xes:event', ns):
-                task = ''
-                user = ''
-                event_type = ''
-                for string in event.findall('xes:string', ns):
-                    if string.attrib['key'] == 'concept:name':
-                        task = string.attrib['value']
-                    if string.attrib['key'] == 'org:resource':
-                        user = string.attrib['value']
-                    if string.attrib['key'] == 'lifecycle:transition':
-                        event_type = string.attrib['value']
-                timestamp = ''
-                for date in event.findall('xes:date', ns):
-                    if date.attrib['key'] == 'time:timestamp':
-                        timestamp = date.attrib['value']
-                        timestamp = datetime.datetime.strptime(timestamp[:-10], '%Y-%m-%dT%H:%M:%S')
-                print(';'.join([caseid, task, event_type, user, str(timestamp)]))
\ No newline at end of file
+from typing import Dict, Iterator, List, Optional, Union
+
+import pandas as pd
+
+from src.event_log.eventlog import EventLog
+
+XES_CASE_ID = 'case:concept:name'
+XES_ACTIVITY = 'concept:name'
+XES_TIMESTAMP = 'time:timestamp'
+
+_ATTRIBUTE_TYPES = {'string', 'date', 'int', 'float', 'boolean', 'id'}
+_BLOCK_SIZE = 1 << 20
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    try:
+        return pd.to_datetime(values, utc=True, format='ISO8601')
+    except (TypeError, ValueError):  # older pandas versions don't know the 'ISO8601' format
+        return pd.to_datetime(values, utc=True)
+
+
+def _convert_types(df: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    for col in df.columns:
+        xes_type = types.get(col)
+        if xes_type == 'date':
+            df[col] = _parse_dates(df[col])
+        elif xes_type == 'int':
+            # nullable, so ints missing on some events don't become floats
+            df[col] = pd.to_numeric(df[col]).astype('Int64')
+        elif xes_type == 'float':
+            df[col] = pd.to_numeric(df[col])
+        elif xes_type == 'boolean':
+            df[col] = df[col].str.lower().map({'true': True, 'false': False}).astype('boolean')
+    return df
+
+
+class _XesBatchParser:
+    """
+    Incremental parser collecting the events of a XES document in batches of rows.
+    Trace attributes are added to all events of the trace with the prefix 'case:'.
+    Processed elements are cleared right away, so only the current trace is kept in memory.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.types: Dict[str, str] = {}
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root: Optional[ET.Element] = None
+        self._stack: List[str] = []
+        self._rows: List[Dict] = []
+        self._trace_rows: List[Dict] = []
+        self._trace_attrs: Dict = {}
+        self._event: Dict = {}
+
+    def feed(self, data: bytes) -> Iterator[pd.DataFrame]:
+        self._parser.feed(data)
+        return self._process_events()
+
+    def close(self) -> Iterator[pd.DataFrame]:
+        self._parser.close()
+        yield from self._process_events()
+        if self._rows:
+            yield self._flush()
+
+    def _flush(self) -> pd.DataFrame:
+        df = _convert_types(pd.DataFrame(self._rows), self.types)
+        self._rows = []
+        return df
+
+    def _process_events(self) -> Iterator[pd.DataFrame]:
+        for action, elem in self._parser.read_events():
+            tag = _local_name(elem.tag)
+            if action == 'start':
+                if self._root is None:
+                    self._root = elem
+                self._stack.append(tag)
+                if tag == 'trace':
+                    self._trace_attrs = {}
+                    self._trace_rows = []
+                elif tag == 'event':
+                    self._event = {}
+                continue
+
+            self._stack.pop()
+            parent = self._stack[-1] if self._stack else None
+            if tag in _ATTRIBUTE_TYPES and parent in ('event', 'trace') and 'key' in elem.attrib:
+                key = elem.attrib['key'] if parent == 'event' else f"case:{elem.attrib['key']}"
+                target = self._event if parent == 'event' else self._trace_attrs
+                target[key] = elem.attrib.get('value')
+                self.types.setdefault(key, tag)
+            elif tag == 'event' and parent == 'trace':
+                self._trace_rows.append(self._event)
+                elem.clear()
+            elif tag == 'trace':
+                for row in self._trace_rows:
+                    row.update(self._trace_attrs)
+                self._rows.extend(self._trace_rows)
+                elem.clear()
+                self._root.clear()  # drop the reference of the document to the processed trace
+                if len(self._rows) >= self.batch_size:
+                    yield self._flush()
+
+
+def _find_trace_start(mm: mmap.mmap, pos: int, end: int) -> int:
+    """
+    Position of the next trace element at or after `pos`, `end` if there is none.
+    """
+    while True:
+        pos = mm.find(b'<trace', pos, end)
+        if pos < 0:
+            return end
+        if mm[pos + 6:pos + 7] in (b' ', b'\t', b'\r', b'\n', b'>', b'/'):
+            return pos
+        pos += 6
+
+
+def _parse_byte_range(xes_file: Path, header: bytes, start: int, stop: int, batch_size: int) -> Optional[pd.DataFrame]:
+    """
+    Parse the traces stored in the given byte range of a XES file as if they were the only traces of the log.
+    """
+    parser = _XesBatchParser(batch_size)
+    batches = []
+    with open(xes_file, 'rb') as f:
+        batches.extend(parser.feed(header))
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = f.read(min(_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            batches.extend(parser.feed(block))
+    batches.extend(parser.feed(b'</log>'))
+    batches.extend(parser.close())
+    return pd.concat(batches, ignore_index=True) if batches else None
+
+
+class XesReader:
+    """
+    Streaming importer for XES event logs (optionally gzip compressed).
+    """
+
+    def __init__(self, batch_size: int = 100_000, n_jobs: int = 1):
+        """
+        :param batch_size: number of events collected before they are converted to a data frame
+        :param n_jobs: number of processes parsing the traces of an uncompressed file in parallel
+        """
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+
+    def iter_batches(self, xes_file: Union[Path, str]) -> Iterator[pd.DataFrame]:
+        """
+        Parse the file sequentially.
+        :return: generator of data frames with one row per event, typed according to the XES attribute types
+        """
+        xes_file = Path(xes_file)
+        parser = _XesBatchParser(self.batch_size)
+        with (gzip.open(xes_file, 'rb') if xes_file.suffix == '.gz' else open(xes_file, 'rb')) as f:
+            for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+                yield from parser.feed(block)
+        yield from parser.close()
+
+    def _split_by_traces(self, xes_file: Path) -> List[Dict]:
+        with open(xes_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            log_end = mm.rfind(b'</log')
+            first_trace = _find_trace_start(mm, 0, log_end)
+            bounds = [_find_trace_start(mm, first_trace + i * (log_end - first_trace) // self.n_jobs, log_end)
+                      for i in range(self.n_jobs)] + [log_end]
+            header = mm[:first_trace]
+        bounds = list(OrderedDict.fromkeys(bounds))
+        return [dict(header=header, start=start, stop=stop) for start, stop in zip(bounds, bounds[1:])]
+
+    def read_frame(self, xes_file: Union[Path, str]) -> pd.DataFrame:
+        xes_file = Path(xes_file)
+        if self.n_jobs > 1 and xes_file.suffix != '.gz':
+            ranges = self._split_by_traces(xes_file)
+            with ProcessPoolExecutor(self.n_jobs) as executor:
+                futures = [executor.submit(_parse_byte_range, xes_file, r['header'], r['start'], r['stop'],
+                                           self.batch_size) for r in ranges]
+                batches = [f.result() for f in futures]
+        else:
+            batches = list(self.iter_batches(xes_file))
+        batches = [b for b in batches if b is not None]
+        if not batches:  # a log without traces still has the standard attributes
+            return pd.DataFrame({XES_CASE_ID: pd.Series(dtype=object), XES_ACTIVITY: pd.Series(dtype=object),
+                                 XES_TIMESTAMP: pd.Series(dtype='datetime64[ns, UTC]')})
+        return pd.concat(batches, ignore_index=True)
+
+    def read(self, xes_file: Union[Path, str], **el_params) -> EventLog:
+        """
+        Import a XES file as event log. By default, the standard XES attributes are used as case id, activity and
+        timestamp.
+        :param el_params: parameters of the event log overriding the defaults
+        """
+        params = dict(case_id_attr=XES_CASE_ID, activity_attr=XES_ACTIVITY, timestamp_attr=XES_TIMESTAMP)
+        params.update(el_params)
+        return EventLog(self.read_frame(xes_file), **params)
@@ -0,0 +1,138 @@
+import operator
+import pickle
+import tempfile
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.event_log.eventlog import EventLog
+
+
+def _read_presorted(path: Union[Path, str], case_id_attr: str, chunksize: int, **read_params) -> Iterator[pd.DataFrame]:
+    carry = None
+    for chunk in pd.read_csv(path, chunksize=chunksize, **read_params):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        # the last case might continue in the next chunk
+        is_last_case = (chunk[case_id_attr] == chunk[case_id_attr].iloc[-1]).to_numpy()
+        carry = chunk[is_last_case]
+        if not is_last_case.all():
+            yield chunk[~is_last_case]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _read_partitioned(path: Union[Path, str], case_id_attr: str, chunksize: int, n_partitions: int,
+                      **read_params) -> Iterator[pd.DataFrame]:
+    with tempfile.TemporaryDirectory(prefix='eventlog_') as tmp_dir:
+        # the parsed frames are spilled (and not the csv text), so all read_params apply exactly as when
+        # reading presorted files: same columns, dtypes, parsed dates, ...
+        partitions = [Path(tmp_dir) / f"part_{i}.pickle" for i in range(n_partitions)]
+        for chunk in pd.read_csv(path, chunksize=chunksize, **read_params):
+            part_ids = pd.util.hash_pandas_object(chunk[case_id_attr], index=False).to_numpy() % np.uint64(n_partitions)
+            for part_id, part in chunk.groupby(part_ids):
+                with open(partitions[int(part_id)], 'ab') as f:
+                    pickle.dump(part, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        for part_file in partitions:
+            if part_file.exists():
+                yield pd.concat(list(_load_all(part_file)), ignore_index=True)
+
+
+def _load_all(part_file: Path) -> Iterator[pd.DataFrame]:
+    with open(part_file, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def read_csv_chunks(path: Union[Path, str], case_id_attr: str, chunksize: int = 100_000, presorted: bool = True,
+                    n_partitions: int = 16, **read_params) -> Iterator[pd.DataFrame]:
+    """
+    Read a csv file in chunks without splitting the events of a case across two chunks.
+    :param path: csv file to read
+    :param case_id_attr: column holding the case id
+    :param chunksize: number of rows read at once
+    :param presorted: if True, the events of each case have to be stored contiguously in the file (e.g. sorted by case).
+    Otherwise, the rows are spilled to `n_partitions` temporary files by the hash of their case id first
+    :param n_partitions: number of temporary partitions; each partition has to fit into memory
+    :param read_params: further parameters for `pd.read_csv`
+    :return: generator of data frames, each holding all events of the cases it contains
+    """
+    if presorted:
+        return _read_presorted(path, case_id_attr, chunksize, **read_params)
+    else:
+        return _read_partitioned(path, case_id_attr, chunksize, n_partitions, **read_params)
+
+
+def iter_eventlogs(path: Union[Path, str], chunksize: int = 100_000, presorted: bool = True, n_partitions: int = 16,
+                   read_params: Optional[dict] = None, **el_params) -> Iterator[EventLog]:
+    """
+    Stream a (too large) csv file as sequence of partial event logs with disjoint cases.
+    :param el_params: parameters for creating the event logs (attribute names, timestamp parsing, ...)
+    :return: generator of event logs
+    """
+    case_id_attr = el_params.get('case_id_attr', 'visitId')
+    for df in read_csv_chunks(path, case_id_attr, chunksize, presorted, n_partitions, **(read_params or {})):
+        yield EventLog(df, **el_params)
+
+
+def reduce_eventlogs(logs: Iterable[EventLog], map_fn: Callable[[EventLog], Any],
+                     reduce_fn: Callable[[Any, Any], Any] = operator.add, initial: Any = None) -> Any:
+    """
+    Aggregate partial event logs in bounded memory, e.g.
+    `reduce_eventlogs(iter_eventlogs(path, **attrs), activity_counts)`
+    :param logs: partial event logs with disjoint cases
+    :param map_fn: computes the partial result of a single log
+    :param reduce_fn: combines the accumulated result with a partial one
+    :param initial: start value of the accumulation, defaults to the first partial result
+    :return: the aggregated result
+    """
+    result = initial
+    for log in logs:
+        partial = map_fn(log)
+        result = partial if result is None else reduce_fn(result, partial)
+    return result
+
+
+# --- map functions for `reduce_eventlogs`
+
+
+def log_size(log: EventLog) -> Counter:
+    return Counter(events=len(log), cases=len(log.case_index))
+
+
+def activity_counts(log: EventLog) -> Counter:
+    return Counter(log._df[log.activity_attr].value_counts().to_dict())
+
+
+def transition_counts(log: EventLog) -> Counter:
+    counts = Counter()
+    variants = log.variants
+    for variant, count in enumerate(variants.counts):
+        activities = variants.get_activities(variant)
+        for pair in zip(activities, activities[1:]):
+            counts[pair] += int(count)
+    return counts
+
+
+def filter_to_csv(logs: Iterable[EventLog], predicate: Callable[[EventLog], pd.Series],
+                  dest_file: Union[Path, str]) -> int:
+    """
+    Write all events matching the predicate to a csv file.
+    :param logs: partial event logs
+    :param predicate: returns a boolean mask over the events of a log
+    :param dest_file: destination csv file
+    :return: number of written events
+    """
+    n_written = 0
+    for i, log in enumerate(logs):
+        events = log._df[predicate(log)]
+        events.to_csv(dest_file, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        n_written += len(events)
+    return n_written
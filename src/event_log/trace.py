@@ -1,45 +1,86 @@
-from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.event_log import derived
 
 
-@dataclass
 class Trace:
-    def __init__(self, df, attrs: Dict = None):
+    """
+    Lightweight view on the events of a single case.
+    The events are not copied - the trace only references the (case-sorted) frame of the log together with the
+    position of its first and one past its last event.
+    """
+    __slots__ = ('activity_attr', 'id_attr', 'ts_attr', 'duration_attr', 'trace_duration_attr', '_df', '_start', '_stop')
+
+    def __init__(self, df: pd.DataFrame, attrs: Dict = None, start: int = 0, stop: Optional[int] = None):
         if not attrs:
             attrs = {}
         self.activity_attr = attrs.get('activity_attr', 'Activity')
         self.id_attr = attrs.get('case_id_attr', 'Case ID')
         self.ts_attr = attrs.get('timestamp_attr', 'Timestamp')
         self.duration_attr = attrs.get('duration_attr', 'Duration')
-        self.features: List[str] = list(df.columns)
-        self.id = df[self.id_attr].iloc[0]
+        self.trace_duration_attr = attrs.get('trace_duration_attr', derived.TRACE_DURATION)
         self._df = df
-        self._events: List[Dict] = df.to_dict('records')
-        self._starttime = self._events[0][self.ts_attr]
+        self._start = start
+        self._stop = len(df) if stop is None else stop
+
+    def _column(self, attr: str) -> pd.Series:
+        return self._df[attr].iloc[self._start:self._stop]
+
+    @property
+    def features(self) -> List[str]:
+        return list(self._df.columns)
+
+    @property
+    def id(self):
+        return self._df[self.id_attr].iloc[self._start]
+
+    @property
+    def _starttime(self):
+        return self._df[self.ts_attr].iloc[self._start]
 
     def __iter__(self):
-        return (e for e in self._events)
+        return iter(self._df.iloc[self._start:self._stop].to_dict('records'))
+
+    @property
+    def activities(self) -> List:
+        return self._column(self.activity_attr).tolist()
+
+    @property
+    def activity_vocabulary(self) -> pd.Index:
+        return self._df[self.activity_attr].cat.categories
 
     @property
-    def activities(self):
-        # tmp_a = ['register request', 'examine thoroughly', 'examine casually', 'check ticket',
-        #          'decide', 'reinitiate request', 'pay compensation', 'reject request']
-        # tmp_map = {a: letter for a, letter in zip(tmp_a, 'abcdefgh')}
-        return [e[self.activity_attr] for e in self._events]
+    def activity_codes(self) -> np.ndarray:
+        """
+        Codes of the activities within the vocabulary of the (dictionary encoded) activity attribute
+        """
+        return self._column(self.activity_attr).cat.codes.to_numpy()
 
     @property
-    def duration(self):
-        last = self._events[-1]
-        return self._starttime - last[self.ts_attr] + last[self.duration_attr]
+    def duration(self) -> float:
+        """
+        Time in milliseconds from the start of the first event until the end of the last event
+        """
+        if self.trace_duration_attr in self._df:
+            return self._df[self.trace_duration_attr].iloc[self._start]
+        events = self._df.iloc[self._start:self._stop]
+        ctx = derived.DerivationContext(events, np.array([0, len(events)]), self.ts_attr, self.duration_attr)
+        return derived.case_durations(ctx)[0]
 
     def get_time_passed(self, ref_time):
         return ref_time - self._starttime
 
     def __len__(self):
-        return len(self._events)
+        return self._stop - self._start
 
     def __getitem__(self, item):
-        return self._events[item]
+        events = self._df.iloc[self._start:self._stop]
+        if isinstance(item, slice):
+            return events.iloc[item].to_dict('records')
+        return events.iloc[item].to_dict()
 
     def __str__(self):
         return f"[{self.id}]  {' -> '.join(self.activities)}"
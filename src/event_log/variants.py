@@ -0,0 +1,88 @@
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+
+class TraceVariants:
+    """
+    Unique activity sequences (variants) of a log together with their multiplicities.
+    Activities are integer encoded; the codes of the i-th variant are `codes[offsets[i]:offsets[i + 1]]`.
+    Results computed once per variant can be mapped back to the cases with `broadcast`.
+    """
+
+    def __init__(self, activity_codes: np.ndarray, trace_offsets: np.ndarray, activities: pd.Index):
+        """
+        :param activity_codes: activity code of every event in the case-sorted log
+        :param trace_offsets: offsets of the cases within the events
+        :param activities: vocabulary decoding the activity codes
+        """
+        self.activities = activities
+        starts, ends = trace_offsets[:-1], trace_offsets[1:]
+        keys = np.empty(len(starts), dtype=object)
+        for i, (s, e) in enumerate(zip(starts, ends)):
+            keys[i] = activity_codes[s:e].tobytes()
+        # variants are numbered in order of their first occurrence
+        self.case_variant, _ = pd.factorize(keys)
+        self.counts = np.bincount(self.case_variant)
+
+        # first case of every variant
+        self.representatives = np.unique(self.case_variant, return_index=True)[1].astype(np.int64)
+
+        lengths = (ends - starts)[self.representatives]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        event_idx = np.repeat(starts[self.representatives] - self.offsets[:-1], lengths) + np.arange(self.offsets[-1])
+        self.codes = activity_codes[event_idx]
+
+    @classmethod
+    def from_activities(cls, activities: pd.Series, trace_offsets: np.ndarray) -> 'TraceVariants':
+        if isinstance(activities.dtype, pd.CategoricalDtype):  # reuse the dictionary encoding of the log
+            return cls(activities.cat.codes.to_numpy(), trace_offsets, activities.cat.categories)
+        codes, vocabulary = pd.factorize(activities)
+        return cls(codes, trace_offsets, pd.Index(vocabulary))
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def sequence(self, variant: int) -> np.ndarray:
+        return self.codes[self.offsets[variant]:self.offsets[variant + 1]]
+
+    def sequences(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self.sequence(i)
+
+    def get_activities(self, variant: int) -> List[str]:
+        return self.activities[self.sequence(variant)].tolist()
+
+    def broadcast(self, variant_values) -> np.ndarray:
+        """
+        Map values computed per variant to all cases.
+        :param variant_values: array-like with one entry (or row) per variant
+        :return: array with one entry (or row) per case in the order of the case ordinals
+        """
+        return np.asarray(variant_values)[self.case_variant]
+
+    def repeat_capped(self, max_count: int) -> np.ndarray:
+        """
+        Variant of every row when each variant is repeated by its count, but at most max_count times.
+        For algorithms without sample weights (e.g. HDBSCAN) frequent variants still form dense groups while the
+        number of rows stays bounded by the number of variants.
+        :return: sorted array of variant numbers, `np.searchsorted(rows, np.arange(len(variants)))` gives the first
+                 row of every variant
+        """
+        return np.repeat(np.arange(len(self)), np.minimum(self.counts, max_count))
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Overview of the variants ordered by their frequency.
+        """
+        df = pd.DataFrame({
+            'Variant': [' -> '.join(self.get_activities(i)) for i in range(len(self))],
+            'Length': self.lengths,
+            'Count': self.counts
+        })
+        return df.sort_values('Count', ascending=False)
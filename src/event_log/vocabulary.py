@@ -0,0 +1,45 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+class Vocabulary:
+    """
+    Dictionaries of the dictionary encoded (categorical) attributes of an event log.
+    Filtered views share the vocabulary of the log they are created from, so codes are comparable between them.
+    """
+
+    def __init__(self, categories: Dict[str, pd.Index]):
+        self._categories = categories
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'Vocabulary':
+        return cls({col: df[col].cat.categories for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+    @property
+    def attributes(self) -> List[str]:
+        return list(self._categories.keys())
+
+    def __contains__(self, attr: str) -> bool:
+        return attr in self._categories
+
+    def __getitem__(self, attr: str) -> pd.Index:
+        return self._categories[attr]
+
+    def size(self, attr: str) -> int:
+        return len(self._categories[attr])
+
+    def encode(self, attr: str, values) -> np.ndarray:
+        """
+        :return: codes of the values, -1 for values not in the vocabulary
+        """
+        return self._categories[attr].get_indexer(values)
+
+    def decode(self, attr: str, codes) -> np.ndarray:
+        """
+        :return: values of the codes, None for -1
+        """
+        codes = np.asarray(codes)
+        values = self._categories[attr].to_numpy(dtype=object)
+        return np.where(codes >= 0, values[np.maximum(codes, 0)] if len(values) else None, None)
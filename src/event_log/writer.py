@@ -0,0 +1,132 @@
+import gzip
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from src.event_log.eventlog import EventLog
+from src.event_log.reader import XES_ACTIVITY, XES_TIMESTAMP
+
+_HEADER = '''<?xml version="1.0" encoding="UTF-8" ?>
+<log xes.version="1.0" xes.features="nested-attributes" xmlns="http://www.xes-standard.org/">
+\t<extension name="Concept" prefix="concept" uri="http://www.xes-standard.org/concept.xesext"/>
+\t<extension name="Time" prefix="time" uri="http://www.xes-standard.org/time.xesext"/>
+\t<classifier name="Activity" keys="concept:name"/>
+'''
+_FOOTER = '</log>\n'
+_CASE_PREFIX = 'case:'
+
+
+def _escape(text: pd.Series) -> pd.Series:
+    return (text.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False).str.replace('"', '&quot;', regex=False))
+
+
+def _xes_type(values: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(values):
+        return 'boolean'
+    elif pd.api.types.is_integer_dtype(values):
+        return 'int'
+    elif pd.api.types.is_float_dtype(values):
+        return 'float'
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        return 'date'
+    return 'string'
+
+
+def _format_dates(values: pd.Series) -> pd.Series:
+    text = values.dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3]  # millisecond precision
+    if values.dt.tz is not None:
+        offset = values.dt.strftime('%z')
+        text = text + offset.str[:3] + ':' + offset.str[3:]
+    return text
+
+
+def _attribute_lines(values: pd.Series, key: str, xes_type: str, indent: str) -> pd.Series:
+    """
+    XML elements of one attribute for many events (or traces) at once; empty for missing values.
+    """
+    if xes_type == 'date':
+        text = _format_dates(values)
+    elif xes_type == 'boolean':
+        text = values.map({True: 'true', False: 'false'})
+    else:
+        text = values.astype(str)
+    if xes_type == 'string':
+        text = _escape(text)
+    present = values.notna().to_numpy()
+    key = key.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;')
+    lines = f'{indent}<{xes_type} key="{key}" value="' + text.astype(object).where(present, '') + '"/>\n'
+    return lines.where(present, '')
+
+
+class XesWriter:
+    """
+    Streaming exporter writing an event log as XES file directly from its case-sorted event frame.
+    """
+
+    def __init__(self, compress: bool = False, batch_size: int = 100_000, include_derived: bool = False):
+        """
+        :param compress: write a gzip compressed file
+        :param batch_size: (approximate) number of events converted at once
+        :param include_derived: also export the derived attributes of the log (e.g. time_passed)
+        """
+        self.compress = compress
+        self.batch_size = batch_size
+        self.include_derived = include_derived
+
+    def _get_attributes(self, log: EventLog) -> Tuple[List, List]:
+        """
+        Determine the trace and event attributes as tuples of column, XES key and XES type.
+        """
+        skipped = {log.case_id_attr} | (set() if self.include_derived else set(log._derived_attrs))
+        renamed = {log.activity_attr: XES_ACTIVITY, log.ts_attr: XES_TIMESTAMP}
+        trace_attrs = [(log.case_id_attr, 'concept:name', 'string')]
+        event_attrs = []
+        for col in log._df.columns:
+            if col in skipped:
+                continue
+            xes_type = _xes_type(log._df[col])
+            if col.startswith(_CASE_PREFIX):
+                trace_attrs.append((col, col[len(_CASE_PREFIX):], xes_type))
+            else:
+                event_attrs.append((col, renamed.get(col, col), xes_type))
+        return trace_attrs, event_attrs
+
+    def _write_cases(self, f, log: EventLog, first: int, last: int, trace_attrs: List, event_attrs: List) -> None:
+        offsets = log._offsets[first:last + 1]
+        events = log._df.iloc[offsets[0]:offsets[-1]]
+        case_rows = events.iloc[offsets[:-1] - offsets[0]]
+
+        trace_xml = pd.Series('\t<trace>\n', index=np.arange(len(case_rows)), dtype=object)
+        for col, key, xes_type in trace_attrs:
+            trace_xml += _attribute_lines(case_rows[col], key, xes_type, '\t\t').to_numpy()
+        event_xml = pd.Series('\t\t<event>\n', index=np.arange(len(events)), dtype=object)
+        for col, key, xes_type in event_attrs:
+            event_xml += _attribute_lines(events[col], key, xes_type, '\t\t\t').to_numpy()
+        event_xml += '\t\t</event>\n'
+
+        event_xml = event_xml.to_numpy()
+        for header, start, stop in zip(trace_xml.to_numpy(), offsets[:-1] - offsets[0], offsets[1:] - offsets[0]):
+            f.write(header)
+            f.write(''.join(event_xml[start:stop]))
+            f.write('\t</trace>\n')
+
+    def write(self, log: EventLog, dest_file: Union[Path, str]) -> None:
+        """
+        Export the traces of an event log. Attributes of columns prefixed with 'case:' are written as trace attributes.
+        :param log: the log to export
+        :param dest_file: destination file
+        """
+        trace_attrs, event_attrs = self._get_attributes(log)
+        open_fn = gzip.open if self.compress else open
+        with open_fn(dest_file, 'wt', encoding='utf-8') as f:
+            f.write(_HEADER)
+            n_cases = len(log.case_index)
+            # split the cases into batches of about `batch_size` events
+            batch_ends = np.searchsorted(log._offsets, np.arange(self.batch_size, log._offsets[-1], self.batch_size))
+            bounds = np.unique(np.concatenate(([0], batch_ends, [n_cases])))
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                self._write_cases(f, log, first, last, trace_attrs, event_attrs)
+            f.write(_FOOTER)
@@ -1,19 +1,120 @@
-from typing import Tuple
+import hashlib
+from collections import OrderedDict
+from typing import Collection, FrozenSet, List, Tuple, Union
 
+import numpy as np
+import pandas as pd
 from pm4py.objects.petri.petrinet import Marking, PetriNet
-from pm4py.algo.discovery.alpha import factory as alpha_miner
-from pm4py.util.constants import PARAMETER_CONSTANT_CASEID_KEY, PARAMETER_CONSTANT_ACTIVITY_KEY
+from pm4py.objects.petri.utils import add_arc_from_to
 
 from src.event_log.eventlog import EventLog
+from src.pmtools.dfg import DirectlyFollowsGraph
+from src.pmtools.matrices import create_footprint_matrix, get_dfg
+
+_CACHE_SIZE = 32
+
+Place = Tuple[FrozenSet[str], FrozenSet[str]]
+
+
+def _find_places(footprint: pd.DataFrame) -> List[Place]:
+    """
+    Determine the maximal pairs (A, B) of activity sets with every a in A causally followed (→) by every b in B
+    while the activities within A and within B are unrelated (#).
+    """
+    activities = list(footprint.index)
+    symbols = footprint.to_numpy()
+    causal = {(activities[i], activities[j]) for i, j in zip(*np.nonzero(symbols == '→'))}
+    unrelated = {(activities[i], activities[j]) for i, j in zip(*np.nonzero(symbols == '#'))}
+
+    def is_unrelated(acts: FrozenSet[str]) -> bool:
+        return all((a, b) in unrelated for a in acts for b in acts)
+
+    def is_causal(src: FrozenSet[str], dst: FrozenSet[str]) -> bool:
+        return all((a, b) in causal for a in src for b in dst)
+
+    pairs = [(frozenset([a]), frozenset([b])) for a, b in causal if (a, a) in unrelated and (b, b) in unrelated]
+    known = set(pairs)
+    i = 0
+    while i < len(pairs):
+        a1, b1 = pairs[i]
+        for a2, b2 in pairs[i + 1:]:
+            if a1 <= a2 or b1 <= b2 or a2 <= a1 or b2 <= b1:
+                candidate = (a1 | a2, b1 | b2)
+                if candidate not in known and is_unrelated(candidate[0]) and is_unrelated(candidate[1]) \
+                        and is_causal(*candidate):
+                    pairs.append(candidate)
+                    known.add(candidate)
+        i += 1
+
+    # keep only the maximal pairs
+    return [(a, b) for a, b in pairs
+            if not any((a <= a2 and b <= b2) and (a, b) != (a2, b2) for a2, b2 in pairs)]
+
+
+def mine_from_footprint(footprint: pd.DataFrame, start_activities: Collection[str],
+                        end_activities: Collection[str]) -> Tuple[PetriNet, Marking, Marking]:
+    """
+    Alpha algorithm on a precomputed footprint matrix.
+    :param footprint: footprint matrix as created by `matrices.create_footprint_matrix`
+    :param start_activities: activities which start a case
+    :param end_activities: activities which end a case
+    :return: petri net with its initial and final marking
+    """
+    net = PetriNet('alpha_net')
+    transitions = {}
+    for activity in footprint.index:
+        transitions[activity] = PetriNet.Transition(str(activity), str(activity))
+        net.transitions.add(transitions[activity])
+
+    source = PetriNet.Place('start')
+    sink = PetriNet.Place('end')
+    net.places.add(source)
+    net.places.add(sink)
+    for activity in start_activities:
+        add_arc_from_to(source, transitions[activity], net)
+    for activity in end_activities:
+        add_arc_from_to(transitions[activity], sink, net)
+
+    for idx, (src, dst) in enumerate(_find_places(footprint)):
+        place = PetriNet.Place(f"p_{idx}: ({', '.join(sorted(map(str, src)))}) -> ({', '.join(sorted(map(str, dst)))})")
+        net.places.add(place)
+        for activity in src:
+            add_arc_from_to(transitions[activity], place, net)
+        for activity in dst:
+            add_arc_from_to(place, transitions[activity], net)
+
+    initial_marking = Marking()
+    initial_marking[source] = 1
+    final_marking = Marking()
+    final_marking[sink] = 1
+    return net, initial_marking, final_marking
 
 
 class AlphaMiner:
+    """
+    Alpha miner working on the footprint and the start and end activities of a log.
+    Mined nets are cached by their inputs, so mining the same log again (e.g. on a rerun of the page) is cheap.
+    """
+    _cache: 'OrderedDict[str, Tuple[PetriNet, Marking, Marking]]' = OrderedDict()
+
+    @staticmethod
+    def _cache_key(footprint: pd.DataFrame, start_activities: pd.Index, end_activities: pd.Index) -> str:
+        h = hashlib.sha1()
+        for part in (list(map(str, footprint.index)), footprint.to_numpy().tolist(),
+                     sorted(map(str, start_activities)), sorted(map(str, end_activities))):
+            h.update(repr(part).encode('utf-8'))
+        return h.hexdigest()
 
-    def mine(self, log: EventLog) -> Tuple[PetriNet, Marking, Marking]:
-        params = {
-            PARAMETER_CONSTANT_CASEID_KEY: log.case_id_attr,
-            PARAMETER_CONSTANT_ACTIVITY_KEY: log.activity_attr
-        }
+    def mine(self, log: Union[EventLog, DirectlyFollowsGraph]) -> Tuple[PetriNet, Marking, Marking]:
+        dfg = get_dfg(log)
+        footprint = create_footprint_matrix(dfg)
+        start_activities, end_activities = dfg.get_start_activities().index, dfg.get_end_activities().index
 
-        res_tpl = alpha_miner.apply(log, parameters=params)
-        return res_tpl
+        key = self._cache_key(footprint, start_activities, end_activities)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            self._cache[key] = mine_from_footprint(footprint, start_activities, end_activities)
+            if len(self._cache) > _CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return self._cache[key]
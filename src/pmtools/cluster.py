@@ -1,19 +1,36 @@
-from functools import partial
+from typing import List, Tuple
 
+import numpy as np
 import pandas as pd
-import markov_clustering as mcl
+from scipy import sparse
 
-from src.pmtools.matrices import create_similarity_matrix
-from src.preprocessing.vectorize import create_corpus, vectorize_trace
+from src.pmtools import mcl
+from src.pmtools.matrices import create_knn_similarity_graph
+from src.preprocessing.vectorize import unique_rows, vectorize_traces
 
 
-def cluster_traces(traces: pd.Series, expansion: int, inflation: float) -> None:
-    corpus = create_corpus(traces)
-    trace2vec_fn = partial(vectorize_trace, corpus)
+def cluster_traces(traces: pd.Series, expansion: int, inflation: float, n_neighbours: int = 10,
+                   min_similarity: float = 0.) -> List[Tuple[int, ...]]:
+    """
+    Markov clustering of traces on the sparse k-nearest-neighbour graph of their activity counts.
+    :param n_neighbours: number of most similar traces every trace is connected to
+    :param min_similarity: minimal cosine similarity of connected traces
+    :return: sorted list of tuples with the positions of the traces of every cluster
+    """
+    # traces with the same activity counts are a single (weighted) node
+    vectors, node_of_trace, node_weights = unique_rows(vectorize_traces(traces))
+    graph = create_knn_similarity_graph(vectors, k=n_neighbours, min_similarity=min_similarity)
 
-    # activity_ids, activities, max_len = vectorize_activities(traces, corpus)
-    mat = create_similarity_matrix(corpus, traces, trace2vec_fn)
+    # every trace is similar to itself like within the full similarity matrix
+    result = mcl.run_mcl(graph + sparse.identity(graph.shape[0], format='csr'), expansion=expansion,
+                         inflation=inflation, loop_value=0, node_weights=node_weights)
+    node_clusters = mcl.get_clusters(result)  # get clusters
 
-    result = mcl.run_mcl(mat, expansion=expansion, inflation=inflation, loop_value=0)
-    clusters = mcl.get_clusters(result)  # get clusters
-    return clusters
+    # clusters of unique vectors -> clusters of trace positions
+    cluster_of_node = np.full(graph.shape[0], -1, dtype=np.int64)
+    for i, cluster in enumerate(node_clusters):
+        cluster_of_node[list(cluster)] = i
+    cluster_of_trace = cluster_of_node[node_of_trace]
+    order = np.argsort(cluster_of_trace, kind='stable')
+    bounds = np.searchsorted(cluster_of_trace[order], np.arange(len(node_clusters) + 1))
+    return sorted(tuple(order[start:stop].tolist()) for start, stop in zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,143 @@
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.event_log.derived import to_milliseconds
+from src.event_log.eventlog import EventLog
+
+
+class DirectlyFollowsGraph:
+    """
+    Incrementally maintainable directly-follows relation of one or many logs.
+    Holds the number of occurrences of every activity, of every directly-follows pair and of the start and end
+    activities of cases together with the summed time between the events of every pair (in ms).
+    Activities are identified by name, so graphs of logs with different vocabularies can be merged.
+    """
+
+    def __init__(self, activities: Optional[pd.Index] = None):
+        self.activities = pd.Index([] if activities is None else activities, dtype=object)
+        n = len(self.activities)
+        self.activity_counts = np.zeros(n, dtype=np.int64)
+        self.start_counts = np.zeros(n, dtype=np.int64)
+        self.end_counts = np.zeros(n, dtype=np.int64)
+        self.pair_counts = np.zeros((n, n), dtype=np.int64)
+        self.pair_durations = np.zeros((n, n), dtype=float)
+
+    @classmethod
+    def from_log(cls, log: EventLog) -> 'DirectlyFollowsGraph':
+        dfg = cls()
+        dfg.update(log)
+        return dfg
+
+    def __len__(self):
+        return len(self.activities)
+
+    def _extend(self, activities: pd.Index) -> np.ndarray:
+        """
+        Add unknown activities to the graph.
+        :return: position of the given activities within the graph
+        """
+        new = activities[~activities.isin(self.activities)]
+        if len(new):
+            n_new = len(new)
+            self.activities = self.activities.append(pd.Index(new, dtype=object))
+            self.activity_counts = np.pad(self.activity_counts, (0, n_new))
+            self.start_counts = np.pad(self.start_counts, (0, n_new))
+            self.end_counts = np.pad(self.end_counts, (0, n_new))
+            self.pair_counts = np.pad(self.pair_counts, ((0, n_new), (0, n_new)))
+            self.pair_durations = np.pad(self.pair_durations, ((0, n_new), (0, n_new)))
+        return self.activities.get_indexer(activities)
+
+    def update(self, log: EventLog) -> 'DirectlyFollowsGraph':
+        """
+        Add the cases of a log, e.g. the sessions appended since the last update.
+        The cases must not continue cases already contained in the graph.
+        :return: the updated graph
+        """
+        offsets = log._offsets
+        n_traced = offsets[-1]
+        vocabulary = log.vocabulary[log.activity_attr]
+        positions = self._extend(vocabulary)
+        n = len(self)
+        codes = log.get_codes(log.activity_attr)[:n_traced]
+        mapped = np.where(codes >= 0, positions[np.maximum(codes, 0)] if len(positions) else -1, -1)
+
+        self.activity_counts += np.bincount(mapped[mapped >= 0], minlength=n)
+        non_empty = offsets[:-1] < offsets[1:]
+        starts, ends = mapped[offsets[:-1][non_empty]], mapped[offsets[1:][non_empty] - 1]
+        self.start_counts += np.bincount(starts[starts >= 0], minlength=n)
+        self.end_counts += np.bincount(ends[ends >= 0], minlength=n)
+
+        # consecutive events are only a transition if the second one doesn't start a new case
+        is_pair = np.ones(max(n_traced - 1, 0), dtype=bool)
+        is_pair[offsets[1:-1] - 1] = False
+        src, dst = mapped[:-1], mapped[1:]
+        is_pair &= (src >= 0) & (dst >= 0)
+        pair_ids = src[is_pair] * n + dst[is_pair]
+        timestamps = to_milliseconds(log.get_column(log.ts_attr))[:n_traced]
+        gaps = np.nan_to_num(np.diff(timestamps)[is_pair])
+        self.pair_counts += np.bincount(pair_ids, minlength=n * n).reshape(n, n)
+        self.pair_durations += np.bincount(pair_ids, weights=gaps, minlength=n * n).reshape(n, n)
+        return self
+
+    def merge(self, other: 'DirectlyFollowsGraph') -> 'DirectlyFollowsGraph':
+        """
+        Add the counts of another graph, e.g. the partial result of another file or shard.
+        :return: the merged graph
+        """
+        positions = self._extend(other.activities)
+        self.activity_counts[positions] += other.activity_counts
+        self.start_counts[positions] += other.start_counts
+        self.end_counts[positions] += other.end_counts
+        self.pair_counts[np.ix_(positions, positions)] += other.pair_counts
+        self.pair_durations[np.ix_(positions, positions)] += other.pair_durations
+        return self
+
+    def __add__(self, other: 'DirectlyFollowsGraph') -> 'DirectlyFollowsGraph':
+        return DirectlyFollowsGraph().merge(self).merge(other)
+
+    def _occurring(self) -> np.ndarray:
+        return np.flatnonzero(self.activity_counts > 0)
+
+    def get_transition_counts(self):
+        """
+        :return: tuple with the occurring activities and the matrix of transition counts between them (row -> column)
+        """
+        occurring = self._occurring()
+        return self.activities[occurring], self.pair_counts[np.ix_(occurring, occurring)]
+
+    def get_mean_durations(self) -> pd.DataFrame:
+        """
+        Mean time in ms between the events of every directly-follows pair, NaN for pairs which never occurred.
+        """
+        occurring = self._occurring()
+        counts = self.pair_counts[np.ix_(occurring, occurring)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.pair_durations[np.ix_(occurring, occurring)] / counts
+        return pd.DataFrame(np.where(counts > 0, mean, np.nan), index=self.activities[occurring],
+                            columns=self.activities[occurring])
+
+    def get_start_activities(self) -> pd.Series:
+        return pd.Series(self.start_counts, index=self.activities)[self.start_counts > 0]
+
+    def get_end_activities(self) -> pd.Series:
+        return pd.Series(self.end_counts, index=self.activities)[self.end_counts > 0]
+
+    def save(self, dest_file: Union[Path, str]) -> None:
+        np.savez_compressed(dest_file, activities=self.activities.to_numpy(dtype=str),
+                            activity_counts=self.activity_counts, start_counts=self.start_counts,
+                            end_counts=self.end_counts, pair_counts=self.pair_counts,
+                            pair_durations=self.pair_durations)
+
+    @classmethod
+    def load(cls, src_file: Union[Path, str]) -> 'DirectlyFollowsGraph':
+        with np.load(src_file) as data:
+            dfg = cls(pd.Index(data['activities'].tolist(), dtype=object))
+            dfg.activity_counts = data['activity_counts']
+            dfg.start_counts = data['start_counts']
+            dfg.end_counts = data['end_counts']
+            dfg.pair_counts = data['pair_counts']
+            dfg.pair_durations = data['pair_durations']
+        return dfg
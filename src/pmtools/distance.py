@@ -0,0 +1,184 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+
+from src.event_log.variants import TraceVariants
+
+# codes and lengths of the traces within the worker processes (set by `_init_worker`)
+_worker_codes: Optional[np.ndarray] = None
+_worker_lengths: Optional[np.ndarray] = None
+
+
+def pad_codes(log, max_length: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Activity codes of all cases of a log as a padded matrix.
+    :param log: event log (or filtered view), or its variants (`log.variants`) to get every distinct sequence once
+    :param max_length: cut traces after this many events
+    :return: tuple with the codes (a row per case or variant, padded with -1) and the lengths of the cases
+    """
+    if isinstance(log, TraceVariants):
+        offsets, activity_codes = log.offsets, log.codes
+    else:
+        offsets, activity_codes = log._offsets, log.get_codes(log.activity_attr)
+    lengths = np.diff(offsets)
+    if max_length is not None:
+        lengths = np.minimum(lengths, max_length)
+    width = int(lengths.max()) if len(lengths) else 0
+    codes = np.full((len(lengths), width), -1, dtype=np.int32)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[rows, cols] = activity_codes[offsets[:-1][rows] + cols]
+    return codes, lengths
+
+
+def edit_distances(a: np.ndarray, a_lengths: np.ndarray, b: np.ndarray, b_lengths: np.ndarray,
+                   max_distance: Optional[int] = None, damerau: bool = False) -> np.ndarray:
+    """
+    Levenshtein (or optimal string alignment) distance of many pairs of sequences at once.
+    The rows of the dynamic program are computed for all pairs together; within a row the insertions are resolved
+    by a cumulative minimum, so there is no loop over the columns.
+    :param a: padded codes of the first sequence of every pair
+    :param a_lengths: lengths of the first sequences
+    :param b: padded codes of the second sequence of every pair
+    :param b_lengths: lengths of the second sequences
+    :param max_distance: distances above are reported as max_distance + 1, pairs exceeding it are dropped early
+    :param damerau: also count the transposition of two adjacent events as a single edit
+    :return: distance of every pair
+    """
+    a_lengths, b_lengths = np.asarray(a_lengths), np.asarray(b_lengths)
+    result = np.where(a_lengths == 0, b_lengths, -1).astype(np.int64)
+    cutoff = np.inf if max_distance is None else max_distance + 1
+    if max_distance is not None:
+        result[(result < 0) & (np.abs(a_lengths - b_lengths) >= cutoff)] = cutoff
+
+    active = np.flatnonzero(result < 0)
+    width = int(b_lengths[active].max()) if len(active) else 0
+    a, b = a[active], b[active, :width]
+    a_len, b_len = a_lengths[active], b_lengths[active]
+    steps = np.arange(width + 1)
+    prev = np.broadcast_to(steps, (len(active), width + 1)).copy()
+    prev_prev = None
+    for i in range(1, int(a_len.max()) + 1 if len(active) else 1):
+        matches = b == a[:, i - 1:i]
+        tmp = np.empty_like(prev)
+        tmp[:, 0] = i
+        tmp[:, 1:] = np.minimum(prev[:, 1:] + 1, prev[:, :-1] + ~matches)
+        if damerau and prev_prev is not None and width > 1:
+            swapped = (b[:, :-1] == a[:, i - 1:i]) & (b[:, 1:] == a[:, i - 2:i - 1]) & ~matches[:, 1:]
+            tmp[:, 2:] = np.where(swapped, np.minimum(tmp[:, 2:], prev_prev[:, :-2] + 1), tmp[:, 2:])
+        # insertions: row[j] = min_k<=j (tmp[k] + j - k)
+        row = np.minimum.accumulate(tmp - steps, axis=1) + steps
+
+        finished = a_len == i
+        if finished.any():
+            result[active[finished]] = row[finished, b_len[finished]]
+        keep = ~finished
+        if max_distance is not None:
+            # the minimum of a row never decreases, so the pair can't get below the cutoff anymore
+            exceeded = keep & (row.min(axis=1) >= cutoff)
+            result[active[exceeded]] = cutoff
+            keep &= ~exceeded
+        if not keep.all():
+            active, a, b, a_len, b_len, row = active[keep], a[keep], b[keep], a_len[keep], b_len[keep], row[keep]
+            prev = prev[keep]
+        if not len(active):
+            break
+        prev_prev, prev = prev, row
+    if max_distance is not None:
+        result = np.minimum(result, cutoff)
+    return result
+
+
+def _init_worker(codes: np.ndarray, lengths: np.ndarray) -> None:
+    global _worker_codes, _worker_lengths
+    _worker_codes, _worker_lengths = codes, lengths
+
+
+def _distance_block(start: int, stop: int, max_distance: Optional[int], damerau: bool,
+                    batch_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Distances of the traces [start, stop) to all following traces.
+    :return: tuple with the rows, columns and distances of the pairs (within the cutoff)
+    """
+    codes, lengths = _worker_codes, _worker_lengths
+    n = len(lengths)
+    # all pairs (i, j) with start <= i < stop and i < j
+    n_following = n - np.arange(start, stop) - 1
+    rows = np.repeat(np.arange(start, stop), n_following)
+    cols = rows + 1 + np.arange(len(rows)) - np.repeat(np.cumsum(n_following) - n_following, n_following)
+    if max_distance is not None:
+        close = np.abs(lengths[rows] - lengths[cols]) <= max_distance
+        rows, cols = rows[close], cols[close]
+
+    distances = np.empty(len(rows), dtype=np.int64)
+    for first in range(0, len(rows), batch_size):
+        r, c = rows[first:first + batch_size], cols[first:first + batch_size]
+        distances[first:first + batch_size] = edit_distances(codes[r], lengths[r], codes[c], lengths[c],
+                                                             max_distance, damerau)
+    if max_distance is not None:
+        within = distances <= max_distance
+        rows, cols, distances = rows[within], cols[within], distances[within]
+    return rows, cols, distances
+
+
+def pairwise_edit_distances(codes: np.ndarray, lengths: np.ndarray, max_distance: Optional[int] = None,
+                            damerau: bool = False, as_sparse: bool = False, n_workers: Optional[int] = None,
+                            block_size: int = 256, batch_size: int = 50_000) -> Union[np.ndarray, sparse.csr_matrix]:
+    """
+    Edit distances between all traces, e.g. as precomputed distance matrix for HDBSCAN.
+    :param codes: padded activity codes of the traces (see `pad_codes`)
+    :param lengths: lengths of the traces
+    :param max_distance: distances above are cut off (max_distance + 1 in the dense result, missing in the sparse one)
+    :param damerau: also count the transposition of two adjacent events as a single edit
+    :param as_sparse: only return the distances within max_distance as sparse matrix
+    :param n_workers: number of worker processes, defaults to the number of CPUs
+    :param block_size: number of traces compared with all following traces by one task
+    :param batch_size: number of pairs computed at once
+    :return: symmetric N x N distance matrix
+    """
+    if as_sparse and max_distance is None:
+        raise ValueError("A sparse distance matrix requires a max_distance")
+    n = len(lengths)
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(codes, lengths)) as executor:
+        futures = [executor.submit(_distance_block, start, stop, max_distance, damerau, batch_size)
+                   for start, stop in bounds]
+        blocks = [f.result() for f in futures]
+
+    rows, cols, distances = (np.zeros(0, dtype=np.int64),) * 3
+    if blocks:
+        rows, cols, distances = (np.concatenate(parts) for parts in zip(*blocks))
+    if as_sparse:
+        # missing entries of sparse matrices are no edges, so identical traces get a tiny instead of zero distance
+        values = np.where(distances == 0, np.finfo(float).eps, distances).astype(float)
+        return sparse.csr_matrix((np.concatenate([values, values]),
+                                  (np.concatenate([rows, cols]), np.concatenate([cols, rows]))), shape=(n, n))
+
+    fill = np.inf if max_distance is None else max_distance + 1
+    mat = np.full((n, n), fill, dtype=float)
+    mat[rows, cols] = distances
+    mat[cols, rows] = distances
+    np.fill_diagonal(mat, 0)
+    return mat
+
+
+def repeat_distances(distances: sparse.spmatrix, rows: np.ndarray) -> sparse.csr_matrix:
+    """
+    Sparse distance matrix of repeated items, e.g. of variants repeated by `TraceVariants.repeat_capped`.
+    Copies of the same item get a tiny instead of zero distance, like identical traces in `pairwise_edit_distances`.
+    :param distances: sparse distance matrix of the items
+    :param rows: item of every row of the result
+    :return: len(rows) x len(rows) distance matrix
+    """
+    distances = sparse.csr_matrix(distances)
+    repeated = distances[rows][:, rows]
+    # pairs of (different) copies of the same item
+    copies = sparse.csr_matrix((np.ones(len(rows)), (np.arange(len(rows)), rows)),
+                               shape=(len(rows), distances.shape[0]))
+    same = sparse.csr_matrix(copies @ copies.T) - sparse.identity(len(rows), format='csr')
+    same.eliminate_zeros()
+    return sparse.csr_matrix(repeated + np.finfo(float).eps * same)
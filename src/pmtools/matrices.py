@@ -1,62 +1,133 @@
-import itertools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
 from sklearn.metrics.pairwise import paired_distances
 from sklearn.metrics.pairwise import cosine_similarity
-from typing import Callable
+from typing import Callable, Optional, Tuple, Union
 from src.event_log.eventlog import EventLog
+from src.pmtools.dfg import DirectlyFollowsGraph
+from src.preprocessing.vectorize import vectorize_traces
 
 
-def create_footprint_matrix(log: EventLog) -> pd.DataFrame:
-    unique_activities = log.get_unique_activities()
-    trans_mat = create_transition_matrix(log, unique_activities)
-
-    # convert to footprint matrix
-    foot_mat = pd.DataFrame(index=unique_activities, columns=unique_activities, data='#')
-    for row, col in itertools.product(unique_activities, unique_activities):
-        fwd_transition = trans_mat.loc[row, col]
-        back_transition = trans_mat.loc[col, row]
-        if fwd_transition > 0:
-            if back_transition > 0:
-                foot_mat.loc[row, col] = '||'
-            else:
-                foot_mat.loc[row, col] = '→'
-        elif back_transition > 0:
-            foot_mat.loc[row, col] = '←'
-    return foot_mat
-
-
-def create_transition_matrix(log, unique_activities):
-    # create transition matrix
-    trans_mat = pd.DataFrame(index=unique_activities, columns=unique_activities, data=0)
-    for trace in log:
-        activities = trace.activities
-        for ai, aj in zip(activities, activities[1:]):
-            trans_mat.loc[ai, aj] += 1
-    return trans_mat
+# directly-follows graphs are shared by all matrices of a log and dropped together with the log
+_log_dfgs: 'weakref.WeakKeyDictionary[EventLog, DirectlyFollowsGraph]' = weakref.WeakKeyDictionary()
 
 
-def create_heuristic_matrix(log: EventLog) -> pd.DataFrame:
-    unique_activities = log.get_unique_activities()
-    trans_mat = create_transition_matrix(log, unique_activities)
+def get_dfg(log: Union[EventLog, DirectlyFollowsGraph]) -> DirectlyFollowsGraph:
+    """
+    Directly-follows graph of a log, computed in one vectorized pass and cached per log.
+    """
+    if isinstance(log, DirectlyFollowsGraph):
+        return log
+    if log not in _log_dfgs:
+        _log_dfgs[log] = DirectlyFollowsGraph.from_log(log)
+    return _log_dfgs[log]
 
-    mat = pd.DataFrame(index=unique_activities, columns=unique_activities, data=0.)
-    for row, col in itertools.product(unique_activities, unique_activities):
-        fwd_transition = trans_mat.loc[row, col]
-        back_transition = trans_mat.loc[col, row]
-        mat.loc[row, col] = (fwd_transition - back_transition) / (fwd_transition + back_transition + 1)
 
-    return mat
+def get_transition_counts(log: Union[EventLog, DirectlyFollowsGraph]) -> Tuple[pd.Index, np.ndarray]:
+    """
+    :return: tuple with the occurring activities and the matrix of transition counts between them (row -> column)
+    """
+    return get_dfg(log).get_transition_counts()
+
+
+def create_transition_matrix(log: Union[EventLog, DirectlyFollowsGraph], unique_activities=None) -> pd.DataFrame:
+    """
+    :param unique_activities: fixed (ordered) activity set of the matrix, activities not occurring in the log get 0
+    """
+    activities, counts = get_transition_counts(log)
+    trans_mat = pd.DataFrame(counts, index=activities, columns=activities)
+    if unique_activities is not None:
+        trans_mat = trans_mat.reindex(index=list(unique_activities), columns=list(unique_activities), fill_value=0)
+    return trans_mat
+
+
+def create_footprint_matrix(log: Union[EventLog, DirectlyFollowsGraph]) -> pd.DataFrame:
+    activities, counts = get_transition_counts(log)
+    fwd = counts > 0
+    back = fwd.T
+    foot_mat = np.select([fwd & back, fwd, back], ['||', '→', '←'], default='#')
+    return pd.DataFrame(foot_mat, index=activities, columns=activities)
 
 
-def create_similarity_matrix(corpus, traces, vectorizer_fn: Callable) -> pd.DataFrame:
-    # vfunc = np.vectorize(vectorizer_fn, otypes=[int] * len(corpus))
-    # mat = vfunc(traces)
-    # mat = np.fromiter((vectorizer_fn(t) for t in traces), dtype=int)
+def create_heuristic_matrix(log: Union[EventLog, DirectlyFollowsGraph]) -> pd.DataFrame:
+    activities, counts = get_transition_counts(log)
+    mat = (counts - counts.T) / (counts + counts.T + 1)
+    return pd.DataFrame(mat, index=activities, columns=activities)
 
-    # return mat
-    m = [vectorizer_fn(t) for t in traces]
+
+def create_similarity_matrix(corpus, traces, vectorizer_fn: Optional[Callable] = None,
+                             batch_vectorizer_fn: Callable[[pd.Series], sparse.spmatrix] = vectorize_traces
+                             ) -> pd.DataFrame:
+    """
+    Cosine similarity between all traces.
+    :param corpus: activities of the traces (only used by per-trace vectorizers)
+    :param traces: series of traces
+    :param vectorizer_fn: function vectorizing a single trace, by default all traces are vectorized at once
+    :param batch_vectorizer_fn: function vectorizing all traces at once into a sparse matrix, e.g.
+                                `vectorize.vectorize_traces` (activity counts, default) or
+                                `vectorize.vectorize_traces_hashed` (hashed n-grams)
+    """
+    if vectorizer_fn is None:
+        m = batch_vectorizer_fn(traces)
+    else:
+        m = [vectorizer_fn(t) for t in traces]
     mat = pd.DataFrame(cosine_similarity(m), columns=traces.index, index=traces.index)
 
     return mat
 
+
+# up to this number of features the transposed trace vectors are kept dense for the block products
+MAX_DENSE_FEATURES = 4096
+
+
+def _knn_block(vectors: sparse.csr_matrix, others, start: int, stop: int, k: int, min_similarity: float):
+    """
+    Top-k neighbours (above the similarity floor) of the rows [start, stop) of the normalized vectors.
+    :param others: transposed normalized vectors (dense or sparse)
+    :return: tuple with rows, columns and similarities of the kept pairs
+    """
+    sim = vectors[start:stop] @ others
+    sim = sim.toarray() if sparse.issparse(sim) else sim
+    rows = np.arange(stop - start)
+    sim[rows, np.arange(start, stop)] = 0  # no self similarity
+    k = min(k, sim.shape[1])
+    cols = np.argpartition(sim, -k, axis=1)[:, -k:] if k > 0 else np.zeros((len(rows), 0), dtype=int)
+    values = np.take_along_axis(sim, cols, axis=1)
+    keep = (values >= min_similarity) & (values > 0)
+    return np.repeat(rows + start, k)[keep.ravel()], cols[keep], values[keep]
+
+
+def create_knn_similarity_graph(vectors: sparse.spmatrix, k: int = 10, min_similarity: float = 0.,
+                                block_size: int = 512, n_workers: Optional[int] = None,
+                                symmetric: bool = True) -> sparse.csr_matrix:
+    """
+    Sparse cosine similarity graph keeping only the k most similar neighbours of every trace.
+    The similarities are computed block by block (by worker threads), so the dense N x N matrix is never created.
+    :param vectors: sparse trace x activity matrix (e.g. of `vectorize.vectorize_traces`)
+    :param k: number of neighbours of every trace
+    :param min_similarity: neighbours with a lower similarity are dropped
+    :param block_size: number of traces compared with all others at once
+    :param n_workers: number of threads, defaults to the number of CPUs
+    :param symmetric: make the graph undirected by keeping an edge if either trace is a neighbour of the other
+    :return: sparse N x N similarity matrix
+    """
+    vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+    n = vectors.shape[0]
+    others = vectors.T.toarray() if vectors.shape[1] <= MAX_DENSE_FEATURES else vectors.T.tocsc()
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        blocks = list(executor.map(lambda b: _knn_block(vectors, others, b[0], b[1], k, min_similarity), bounds))
+
+    graph = sparse.csr_matrix((n, n), dtype=np.float32)
+    if blocks:
+        rows, cols, values = (np.concatenate(parts) for parts in zip(*blocks))
+        graph = sparse.csr_matrix((values, (rows, cols)), shape=(n, n))
+    if symmetric:
+        graph = graph.maximum(graph.T).tocsr()
+    return graph
@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def _normalize(mat: sparse.csc_matrix, weights: np.ndarray) -> sparse.csc_matrix:
+    """
+    Make the columns stochastic. A node with weight w stands for w identical nodes, so its row counts w times.
+    """
+    col_sums = np.asarray(mat.multiply(weights[:, None]).sum(axis=0)).ravel()
+    col_sums[col_sums == 0] = 1
+    return sparse.csc_matrix(mat.multiply(1 / col_sums[None, :]))
+
+
+def _prune(mat: sparse.csc_matrix, weights: np.ndarray, threshold: float, top_k: Optional[int]) -> sparse.csc_matrix:
+    """
+    Drop entries whose (weighted) mass is below the threshold and all but the top-k entries of every column.
+    The largest entry of every column is always kept.
+    """
+    if not mat.nnz:
+        return mat
+    counts = np.diff(mat.indptr)
+    cols = np.repeat(np.arange(mat.shape[1]), counts)
+    # a column is a distribution over the weighted mass of the rows, so a node standing for many identical nodes
+    # has small single entries
+    mass = mat.data * weights[mat.indices]
+    col_max = np.zeros(mat.shape[1])
+    filled = counts > 0
+    col_max[filled] = np.maximum.reduceat(mass, mat.indptr[:-1][filled])
+    keep = (mass >= threshold) | (mass == col_max[cols])
+    if top_k is not None and counts.max() > top_k:
+        order = np.lexsort((-mass, cols))
+        rank = np.empty(mat.nnz, dtype=np.int64)
+        rank[order] = np.arange(mat.nnz) - np.repeat(mat.indptr[:-1], counts)
+        keep &= rank < top_k
+    mat.data[~keep] = 0
+    mat.eliminate_zeros()
+    return mat
+
+
+def _expand(mat: sparse.csc_matrix, weights: np.ndarray, power: int, n_workers: int,
+            block_size: int) -> sparse.csc_matrix:
+    """
+    Raise the matrix to the given power, the column blocks of the result are computed by worker threads.
+    """
+    left = sparse.csr_matrix(mat.multiply(weights[None, :]))
+    n = mat.shape[1]
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+
+    def expand_block(bound: Tuple[int, int]) -> sparse.csc_matrix:
+        block = mat[:, bound[0]:bound[1]]
+        for _ in range(power - 1):
+            block = left @ block
+        return sparse.csc_matrix(block)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        blocks = list(executor.map(expand_block, bounds))
+    return sparse.hstack(blocks, format='csc') if blocks else mat
+
+
+def _inflate(mat: sparse.csc_matrix, weights: np.ndarray, power: float) -> sparse.csc_matrix:
+    mat = mat.copy()
+    mat.data **= power
+    return _normalize(mat, weights)
+
+
+def _converged(mat: sparse.csc_matrix, last: sparse.csc_matrix, tolerance: float) -> bool:
+    if mat.nnz != last.nnz:
+        return False
+    diff = mat - last
+    return diff.nnz == 0 or np.abs(diff.data).max() <= tolerance
+
+
+def run_mcl(matrix, expansion: int = 2, inflation: float = 2, loop_value: float = 1, iterations: int = 100,
+            pruning_threshold: float = 0.001, top_k: Optional[int] = None, node_weights: Optional[np.ndarray] = None,
+            convergence_check_frequency: int = 1, tolerance: float = 1e-6, n_workers: Optional[int] = None,
+            block_size: int = 1024) -> sparse.csc_matrix:
+    """
+    Markov clustering on a sparse similarity matrix.
+    :param matrix: symmetric (sparse or dense) N x N similarity matrix
+    :param expansion: power of the expansion step
+    :param inflation: power of the inflation step
+    :param loop_value: value added to the diagonal (self loops)
+    :param iterations: maximal number of iterations
+    :param pruning_threshold: entries with a (weighted) mass below this value are dropped after every expansion
+    :param top_k: only keep the k largest entries of every column after every expansion
+    :param node_weights: number of (identical) nodes every node stands for, e.g. the number of equal traces
+    :param convergence_check_frequency: check for convergence every this many iterations
+    :param tolerance: maximal change of an entry between two checks for the result to be converged
+    :param n_workers: number of threads of the expansion step, defaults to the number of CPUs
+    :param block_size: number of columns expanded at once by a worker
+    :return: the converged matrix, see `get_clusters`
+    """
+    mat = sparse.csc_matrix(matrix, dtype=np.float64)
+    n = mat.shape[0]
+    weights = np.ones(n) if node_weights is None else np.asarray(node_weights, dtype=np.float64)
+    if loop_value:
+        mat = sparse.csc_matrix(mat + loop_value * sparse.identity(n, format='csc'))
+    mat = _normalize(mat, weights)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    last = mat
+    for i in range(iterations):
+        mat = _expand(mat, weights, expansion, n_workers, block_size)
+        mat = _prune(mat, weights, pruning_threshold, top_k)
+        mat = _inflate(mat, weights, inflation)
+        if (i + 1) % convergence_check_frequency == 0:
+            if _converged(mat, last, tolerance):
+                break
+            last = mat
+    return mat
+
+
+def get_clusters(matrix) -> List[Tuple[int, ...]]:
+    """
+    Clusters of a converged MCL matrix: the nodes attracted by every attractor (node with a non-zero self loop).
+    :return: sorted list of tuples with the nodes of every cluster
+    """
+    mat = sparse.csr_matrix(matrix)
+    attractors = np.flatnonzero(mat.diagonal() > 0)
+    clusters = {tuple(mat.indices[mat.indptr[a]:mat.indptr[a + 1]][mat.data[mat.indptr[a]:mat.indptr[a + 1]] > 0]
+                      .tolist()) for a in attractors}
+    return sorted(tuple(sorted(c)) for c in clusters)
@@ -0,0 +1,145 @@
+import hashlib
+import pickle
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+
+import hdbscan
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+from src.preprocessing.vectorize import iter_hashed_ngrams
+
+
+def _log_fingerprint(log) -> str:
+    """
+    Hash of the activity sequences of all cases, equal ids with different events give a different fingerprint.
+    """
+    offsets = log._offsets
+    h = hashlib.sha1(np.ascontiguousarray(offsets, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(log.get_codes(log.activity_attr)[:offsets[-1]]).tobytes())
+    h.update(repr(list(log.vocabulary[log.activity_attr])).encode('utf-8'))
+    return h.hexdigest()
+
+
+class OutlierModel:
+    """
+    HDBSCAN clustering of the sessions of a log on their hashed n-gram vectors which can be saved and used to
+    score new sessions without clustering all sessions again.
+    The hashed n-gram vectorizer has no vocabulary, so its parameters are its whole state.
+    Sessions with the same activity sequence have the same vector, so the model works on the variants of a log.
+    HDBSCAN has no sample weights: a variant is clustered as min(count, min_cluster_size) identical points, which
+    lets a frequent variant form a cluster of its own.
+    """
+
+    def __init__(self, n: int = 3, n_features: int = 512, min_cluster_size: int = 4, min_samples: int = 1,
+                 cluster_selection_epsilon: float = 0.5, outlier_threshold: float = 0.6):
+        """
+        :param n: n-grams of length 1 up to n are used
+        :param n_features: dimension of the n-gram vectors
+        :param min_cluster_size: see `hdbscan.HDBSCAN`
+        :param min_samples: see `hdbscan.HDBSCAN`
+        :param cluster_selection_epsilon: see `hdbscan.HDBSCAN`
+        :param outlier_threshold: sessions with a higher outlier score are outliers
+        """
+        self.n = n
+        self.n_features = n_features
+        self.min_cluster_size = min_cluster_size
+        self.min_samples = min_samples
+        self.cluster_selection_epsilon = cluster_selection_epsilon
+        self.outlier_threshold = outlier_threshold
+        self.clusterer: Optional[hdbscan.HDBSCAN] = None
+        self.case_index: Optional[pd.Index] = None
+        self.fingerprint: Optional[str] = None
+        self.case_variant: Optional[np.ndarray] = None
+        self._variant_rows: Optional[np.ndarray] = None
+
+    @property
+    def params(self) -> Dict:
+        return dict(n=self.n, n_features=self.n_features, min_cluster_size=self.min_cluster_size,
+                    min_samples=self.min_samples, cluster_selection_epsilon=self.cluster_selection_epsilon,
+                    outlier_threshold=self.outlier_threshold)
+
+    def _iter_vectors(self, log, batch_size: int) -> Iterator[np.ndarray]:
+        # normalized, so the euclidean distance follows the cosine similarity
+        for batch in iter_hashed_ngrams(log, n=self.n, n_features=self.n_features, batch_size=batch_size):
+            yield normalize(batch).toarray()
+
+    def fit(self, log, batch_size: int = 10_000) -> 'OutlierModel':
+        """
+        Cluster the sessions of a log.
+        :param log: event log (or filtered view) of the sessions
+        :param batch_size: number of variants vectorized at once
+        :return: the fitted model
+        """
+        variants = log.variants
+        vectors = np.concatenate(list(self._iter_vectors(variants, batch_size)) or [np.zeros((0, self.n_features))])
+        rows = variants.repeat_capped(self.min_cluster_size)
+        self.clusterer = hdbscan.HDBSCAN(min_cluster_size=self.min_cluster_size, min_samples=self.min_samples,
+                                         cluster_selection_epsilon=self.cluster_selection_epsilon,
+                                         prediction_data=True).fit(vectors[rows])
+        # first point of every variant
+        self._variant_rows = np.searchsorted(rows, np.arange(len(variants)))
+        self.case_variant = variants.case_variant
+        self.case_index = log.case_index
+        self.fingerprint = _log_fingerprint(log)
+        return self
+
+    def is_fitted_on(self, log) -> bool:
+        """
+        :return: whether the model was fitted on the same sessions (ids and activity sequences) as the given log
+        """
+        # models of older versions were fitted per session and have no variant mapping
+        return getattr(self, 'case_variant', None) is not None and self.case_index.equals(log.case_index) \
+            and self.fingerprint == _log_fingerprint(log)
+
+    @property
+    def results(self) -> pd.DataFrame:
+        """
+        Cluster label, membership probability and outlier score of the sessions the model was fitted on.
+        """
+        case_rows = self._variant_rows[self.case_variant]
+        return pd.DataFrame({
+            'label': self.clusterer.labels_[case_rows],
+            'probability': self.clusterer.probabilities_[case_rows],
+            'outlier_score': self.clusterer.outlier_scores_[case_rows],
+        }, index=self.case_index)
+
+    def score(self, log, batch_size: int = 10_000) -> pd.DataFrame:
+        """
+        Assign new (or unseen) sessions to the clusters of the model by approximate prediction.
+        :param log: event log (or filtered view) of the sessions
+        :param batch_size: number of variants scored at once
+        :return: frame with the cluster label, membership probability and outlier score of every session
+        """
+        variants = log.variants
+        parts = []
+        for vectors in self._iter_vectors(variants, batch_size):
+            labels, probabilities = hdbscan.approximate_predict(self.clusterer, vectors)
+            outlier_scores = hdbscan.approximate_predict_scores(self.clusterer, vectors)
+            parts.append(pd.DataFrame({'label': labels, 'probability': probabilities,
+                                       'outlier_score': outlier_scores}))
+        scores = pd.concat(parts, ignore_index=True) if parts else \
+            pd.DataFrame(columns=['label', 'probability', 'outlier_score'])
+        # every session gets the scores of its variant
+        scores = scores.iloc[variants.case_variant]
+        scores.index = log.case_index
+        return scores
+
+    def get_outliers(self, scores: pd.DataFrame) -> pd.Index:
+        """
+        :return: ids of the sessions with an outlier score above the threshold of the model
+        """
+        return scores.index[scores['outlier_score'] > self.outlier_threshold]
+
+    def save(self, dest_file: Union[Path, str]) -> None:
+        with open(dest_file, 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, src_file: Union[Path, str]) -> 'OutlierModel':
+        with open(src_file, 'rb') as f:
+            model = pickle.load(f)
+        if not isinstance(model, cls):
+            raise ValueError(f"{src_file} does not contain an {cls.__name__}")
+        return model
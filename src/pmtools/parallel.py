@@ -0,0 +1,155 @@
+import operator
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+from src.event_log.eventlog import EventLog
+from src.pmtools.dfg import DirectlyFollowsGraph
+
+# shared memory backed file system (if available) for handing the shards to the worker processes
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class Aggregation(NamedTuple):
+    map_fn: Callable[[EventLog], Any]
+    reduce_fn: Callable[[Any, Any], Any]
+
+
+_AGGREGATIONS: Dict[str, Aggregation] = {}
+
+
+def register_aggregation(name: str, map_fn: Callable[[EventLog], Any],
+                         reduce_fn: Callable[[Any, Any], Any] = operator.add) -> None:
+    """
+    Register an aggregation which can be computed on case-partitioned shards of a log.
+    :param name: name of the aggregation
+    :param map_fn: computes the partial result of a shard (has to be a module level function to be usable by workers)
+    :param reduce_fn: combines two partial results
+    """
+    _AGGREGATIONS[name] = Aggregation(map_fn, reduce_fn)
+
+
+def get_aggregations() -> List[str]:
+    return list(_AGGREGATIONS.keys())
+
+
+def _event_shards(log: EventLog, n_shards: int) -> np.ndarray:
+    """
+    Shard of every event determined by the hash of its case id, -1 for events without case.
+    """
+    case_hashes = pd.util.hash_pandas_object(log.case_index.to_series(), index=False).to_numpy()
+    case_shards = (case_hashes % np.uint64(n_shards)).astype(np.int64)
+    case_ordinals = log.get_event_case_ordinals()
+    return np.where(case_ordinals >= 0, case_shards[np.maximum(case_ordinals, 0)] if len(case_shards) else -1, -1)
+
+
+def _write_shards(log: EventLog, n_shards: int, dest_dir: Path) -> List[Path]:
+    """
+    Store the shards as uncompressed Arrow IPC files which the workers memory map.
+    """
+    event_shards = _event_shards(log, n_shards)
+    order = np.argsort(event_shards, kind='stable')
+    bounds = np.searchsorted(event_shards[order], np.arange(n_shards + 1))
+    shard_files = []
+    for shard, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if start == stop:
+            continue
+        shard_file = dest_dir / f"shard_{shard}.arrow"
+        feather.write_feather(log._df.iloc[order[start:stop]].reset_index(drop=True), str(shard_file),
+                              compression='uncompressed')
+        shard_files.append(shard_file)
+    return shard_files
+
+
+def _map_shard(shard_file: Path, el_params: Dict, map_fn: Callable[[EventLog], Any]) -> Any:
+    df = feather.read_table(str(shard_file), memory_map=True).to_pandas()
+    return map_fn(EventLog(df, **el_params))
+
+
+def run_aggregation(log: EventLog, aggregation: str, n_workers: Optional[int] = None,
+                    n_shards: Optional[int] = None) -> Any:
+    """
+    Compute an aggregation of the log in parallel: the log is partitioned into shards by the hash of the case ids,
+    every shard is aggregated by a worker process and the partial results are reduced.
+    :param log: the log to aggregate
+    :param aggregation: name of a registered aggregation (see `get_aggregations`)
+    :param n_workers: number of worker processes, defaults to the number of CPUs
+    :param n_shards: number of shards, defaults to the number of workers
+    :return: the aggregated result
+    """
+    map_fn, reduce_fn = _AGGREGATIONS[aggregation]
+    n_workers = n_workers or os.cpu_count() or 1
+    n_shards = n_shards or n_workers
+    el_params = dict(case_id_attr=log.case_id_attr, activity_attr=log.activity_attr, timestamp_attr=log.ts_attr,
+                     duration_attr=log.duration_attr, categorical_attrs=[])
+
+    with tempfile.TemporaryDirectory(prefix='eventlog_shards_', dir=_SHM_DIR) as tmp_dir:
+        shard_files = _write_shards(log, n_shards, Path(tmp_dir))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_map_shard, f, el_params, map_fn) for f in shard_files]
+            result = None
+            for future in futures:
+                partial = future.result()
+                result = partial if result is None else reduce_fn(result, partial)
+    return result
+
+
+# --- built-in aggregations
+
+
+def activity_frequencies(log: EventLog) -> Counter:
+    return Counter(log.get_column(log.activity_attr).value_counts().to_dict())
+
+
+def log_size(log: EventLog) -> Counter:
+    return Counter(events=len(log), cases=len(log.case_index))
+
+
+def trace_durations(log: EventLog) -> pd.Series:
+    """ Duration (in ms) of every case """
+    return pd.Series(log.get_column(log.trace_duration_attr).to_numpy()[log._offsets[:-1]], index=log.case_index)
+
+
+def case_durations_and_counts(log: EventLog) -> pd.DataFrame:
+    """ Summed duration of the events and number of events of every case """
+    durations = log.get_column(log.duration_attr).to_numpy(dtype=float)[:log._offsets[-1]]
+    return pd.DataFrame({
+        'duration': np.add.reduceat(durations, log._offsets[:-1]) if len(durations) else durations,
+        'count': log.case_lengths
+    }, index=log.case_index)
+
+
+def case_features(log: EventLog) -> pd.DataFrame:
+    """ Features of every case, see `EventLog.case_features` """
+    return log.case_features
+
+
+def _concat(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([a, b])
+
+
+def get_case_features(log: EventLog, n_workers: Optional[int] = None, min_events: int = 100_000) -> pd.DataFrame:
+    """
+    `EventLog.case_features` computed on shards in parallel for large logs.
+    :param min_events: smaller logs are aggregated in the calling process, where starting workers doesn't pay off
+    :return: frame with the features of every case in the order of `log.case_index`
+    """
+    if len(log) < min_events:
+        return log.case_features
+    features = run_aggregation(log, 'case_features', n_workers=n_workers)
+    return features.reindex(log.case_index)
+
+
+register_aggregation('dfg', DirectlyFollowsGraph.from_log)
+register_aggregation('activity_frequencies', activity_frequencies)
+register_aggregation('log_size', log_size)
+register_aggregation('trace_durations', trace_durations, _concat)
+register_aggregation('case_durations_and_counts', case_durations_and_counts, _concat)
+register_aggregation('case_features', case_features, _concat)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from src.pmtools.matrices import MAX_DENSE_FEATURES
+
+DTYPES = ('float32', 'float16')
+
+
+def _sidecar(dest_file: Path) -> Path:
+    return dest_file.with_name(dest_file.name + '.json')
+
+
+def _index_file(dest_file: Path) -> Path:
+    return dest_file.with_name(dest_file.name + '.index.json')
+
+
+def _fingerprint(vectors: sparse.csr_matrix) -> str:
+    h = hashlib.sha1(repr(vectors.shape).encode('utf-8'))
+    for arr in (vectors.indptr, vectors.indices, vectors.data):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+class SimilarityMemmap:
+    """
+    Lazy reader of a similarity matrix stored by `create_similarity_memmap`. Only the requested rows are read.
+    """
+
+    def __init__(self, src_file: Union[Path, str]):
+        self.path = Path(src_file)
+        with open(_sidecar(self.path)) as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        index_file = _index_file(self.path)
+        self.index = None
+        if index_file.exists():
+            with open(index_file) as f:
+                self.index = pd.Index(json.load(f))
+        # an empty file can't be memory mapped
+        self._mat = np.memmap(self.path, dtype=self.dtype, mode='r', shape=self.shape) if self.shape[0] \
+            else np.zeros(self.shape, dtype=self.dtype)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.meta['done']) == self.meta['n_blocks']
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """
+        :return: similarities of the rows [start, stop) as (float32) array in memory
+        """
+        return np.asarray(self._mat[start:stop], dtype=np.float32)
+
+    def __getitem__(self, item) -> np.ndarray:
+        return self._mat[item]
+
+    def iter_blocks(self, block_size: int = 1024) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        :return: iterator of the first row and the similarities of consecutive row blocks
+        """
+        for start in range(0, self.shape[0], block_size):
+            yield start, self.rows(start, min(start + block_size, self.shape[0]))
+
+
+def create_similarity_memmap(vectors: sparse.spmatrix, dest_file: Union[Path, str], dtype: str = 'float32',
+                             block_size: int = 1024, n_workers: Optional[int] = None,
+                             index: Optional[pd.Index] = None) -> SimilarityMemmap:
+    """
+    Exact cosine similarity of all pairs of traces for matrices which don't fit into memory.
+    Row blocks are computed by worker threads and written to a memory mapped file; the finished blocks are recorded
+    in a sidecar file (`<dest_file>.json`), so an interrupted computation continues where it stopped.
+    :param vectors: sparse trace x activity matrix (e.g. of `vectorize.vectorize_traces`)
+    :param dest_file: file storing the N x N matrix
+    :param dtype: storage type, 'float32' or 'float16'
+    :param block_size: number of rows computed at once by a worker
+    :param n_workers: number of threads, defaults to the number of CPUs
+    :param index: optional ids of the traces (e.g. `traces.index`) stored once in `<dest_file>.index.json`;
+                  a resumed computation keeps the stored ids if none are given
+    :return: reader of the stored matrix
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype '{dtype}', expected one of {DTYPES}")
+    dest_file = Path(dest_file)
+    vectors = sparse.csr_matrix(vectors, dtype=np.float32)
+    n = vectors.shape[0]
+    if n:
+        vectors = normalize(vectors)
+    n_blocks = (n + block_size - 1) // block_size
+    meta = dict(shape=[n, n], dtype=dtype, block_size=block_size, n_blocks=n_blocks,
+                fingerprint=_fingerprint(vectors), done=[])
+
+    sidecar = _sidecar(dest_file)
+    if dest_file.exists() and sidecar.exists():
+        with open(sidecar) as f:
+            stored = json.load(f)
+        if all(stored.get(key) == meta[key] for key in ('shape', 'dtype', 'block_size', 'fingerprint')):
+            meta['done'] = stored['done']
+    if not meta['done']:
+        # allocate the whole file, the blocks map only their own rows
+        with open(dest_file, 'wb') as f:
+            f.truncate(n * n * np.dtype(dtype).itemsize)
+    # the ids are written once and not with every update of the sidecar
+    index_file = _index_file(dest_file)
+    if index is not None:
+        with open(index_file, 'w') as f:
+            json.dump(list(map(str, index)), f)
+    elif not meta['done'] and index_file.exists():
+        index_file.unlink()  # ids of a previous computation
+
+    lock = threading.Lock()
+
+    def save_meta():
+        tmp_file = sidecar.with_name(sidecar.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, sidecar)
+
+    others = vectors.T.toarray() if vectors.shape[1] <= MAX_DENSE_FEATURES else vectors.T.tocsc()
+
+    def compute_block(block: int) -> None:
+        start, stop = block * block_size, min((block + 1) * block_size, n)
+        sim = vectors[start:stop] @ others
+        rows = np.memmap(dest_file, dtype=dtype, mode='r+', shape=(stop - start, n),
+                         offset=start * n * np.dtype(dtype).itemsize)
+        rows[:] = sim.toarray() if sparse.issparse(sim) else sim
+        rows.flush()  # only the rows of this block
+        del rows
+        with lock:
+            meta['done'].append(block)
+            save_meta()
+
+    save_meta()
+    todo = sorted(set(range(n_blocks)) - set(meta['done']))
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        list(executor.map(compute_block, todo))
+    return SimilarityMemmap(dest_file)
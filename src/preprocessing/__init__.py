@@ -21,4 +21,4 @@ def convert_weblog(df: pd.DataFrame, column_mapping: Dict, column_transformation
 
 
 def filter_by_session_length(df: pd.DataFrame, session_col: str, min_len: int = 2) -> pd.DataFrame:
-    return df[df[session_col].groupby(df[session_col]).transform('size') >= min_len]
+    return df[df[session_col].groupby(df[session_col], observed=True).transform('size') >= min_len]
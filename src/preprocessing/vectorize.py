@@ -1,18 +1,27 @@
 from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
 
 import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from src.event_log.variants import TraceVariants
+
+WEIGHTINGS = (None, 'binary', 'tfidf')
+
+_HASH_PRIME = np.uint64(0x100000001b3)
 
 
 def create_corpus(traces) -> OrderedDict:
-    unique_activities = set()
-    for trace in traces:
-        for event in trace._events:
-            # print(f'ID: {event.get("visitId")}; Activity: {event.get("activity")} ')
-            unique_activities.add(event.get("activity"))
-    corpus = OrderedDict()
-    for c, activity in enumerate(unique_activities):
-        corpus[activity] = c
-    return corpus
+    """
+    Map the activities of the (shared) activity vocabulary of the traces to their codes.
+    The code of an activity is its position within the vectors of the traces.
+    """
+    if len(traces) == 0:
+        return OrderedDict()
+    vocabulary = next(iter(traces)).activity_vocabulary
+    return OrderedDict((activity, c) for c, activity in enumerate(vocabulary))
 
 
 def vectorize_activities(traces, corpus):
@@ -20,29 +29,15 @@ def vectorize_activities(traces, corpus):
     activity_list = {}
     max_len = 0
     for trace in traces:
-        act = []
-        act_name = []
-        for events in trace._events:
-            act.append(corpus.get(events.get("activity")))
-            act_name.append(events.get("activity"))
+        act = trace.activity_codes
         if len(act) > max_len:
             max_len = len(act)
 
-        activity_list_ids[events.get("visitId")] = act
-        activity_list[events.get("visitId")] = act_name
+        activity_list_ids[trace.id] = act
+        activity_list[trace.id] = trace.activities
     return activity_list_ids, activity_list, max_len
 
 
-def create_np_matrix(vectors, maxlen):
-    names = []
-    padded_vectors = []
-    for _, vector in vectors.items():
-        padded_vectors.append(np.pad(vector,
-                                     (0, maxlen - len(vector)),
-                                     'constant', constant_values=0))
-    return np.array(padded_vectors)
-
-
 def vectorize_trace(corpus, trace) -> np.array:
     """
     Create a vector of fixed length where each number donates number of occurrences of an activity in the trace
@@ -50,7 +45,179 @@ def vectorize_trace(corpus, trace) -> np.array:
     :param trace: trace which shall be vectorized
     :return: vectorized trace as array of numbers
     """
-    vec = np.zeros(len(corpus), dtype=int)
-    for a in trace:
-        vec[corpus.get(a["activity"])] += 1
-    return vec
+    codes = trace.activity_codes
+    return np.bincount(codes[codes >= 0], minlength=len(corpus))
+
+
+def _count_matrix(codes: np.ndarray, starts: np.ndarray, stops: np.ndarray, n_activities: int) -> sparse.csr_matrix:
+    """
+    Case x activity count matrix of the event ranges [start, stop) of the given activity codes.
+    """
+    lengths = stops - starts
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    # positions of all events of the ranges without a python loop over the cases
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    cols = codes[positions]
+    known = cols >= 0
+    mat = sparse.csr_matrix((np.ones(known.sum(), dtype=np.float64), (rows[known], cols[known])),
+                            shape=(len(starts), n_activities))
+    mat.sum_duplicates()
+    return mat
+
+
+def _weight(mat: sparse.csr_matrix, weighting: Optional[str]) -> sparse.csr_matrix:
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f"Unknown weighting '{weighting}', expected one of {WEIGHTINGS}")
+    if weighting == 'binary':
+        mat.data[:] = 1
+    elif weighting == 'tfidf':
+        mat = TfidfTransformer().fit_transform(mat).tocsr()
+    return mat
+
+
+def _sequences(log) -> Tuple[np.ndarray, np.ndarray, pd.Index]:
+    """
+    :return: tuple with the activity codes, the offsets of the sequences and the activity vocabulary of a log or
+             of its variants
+    """
+    if isinstance(log, TraceVariants):
+        return log.codes, log.offsets, log.activities
+    return log.get_codes(log.activity_attr), log._offsets, log.vocabulary[log.activity_attr]
+
+
+def vectorize_log(log, weighting: Optional[str] = None) -> sparse.csr_matrix:
+    """
+    Vectorize all cases of an event log at once.
+    :param log: event log (or filtered view) with a dictionary encoded activity attribute, or its variants
+                (`log.variants`) to vectorize every distinct sequence once
+    :param weighting: None for activity counts, 'binary' for occurrence or 'tfidf'
+    :return: sparse matrix with a row per case (in order of `log.case_index`) or variant and a column per activity of
+             the activity vocabulary
+    """
+    codes, offsets, activities = _sequences(log)
+    mat = _count_matrix(codes, offsets[:-1], offsets[1:], len(activities))
+    return _weight(mat, weighting)
+
+
+def vectorize_traces(traces: pd.Series, weighting: Optional[str] = None) -> sparse.csr_matrix:
+    """
+    Vectorize traces which are views on the same log.
+    :param traces: series of traces (e.g. `log.traces`)
+    :param weighting: None for activity counts, 'binary' for occurrence or 'tfidf'
+    :return: sparse matrix with a row per trace and a column per activity of the activity vocabulary
+    """
+    if len(traces) == 0:
+        return sparse.csr_matrix((0, 0))
+    first = traces.iloc[0]
+    codes = first._df[first.activity_attr].cat.codes.to_numpy()
+    starts = np.fromiter((t._start for t in traces), dtype=np.int64, count=len(traces))
+    stops = np.fromiter((t._stop for t in traces), dtype=np.int64, count=len(traces))
+    mat = _count_matrix(codes, starts, stops, len(first.activity_vocabulary))
+    return _weight(mat, weighting)
+
+
+def _activity_hashes(vocabulary: pd.Index) -> np.ndarray:
+    """
+    Hashes of the activity names which are stable across logs and processes (unlike the codes of a vocabulary).
+    """
+    return pd.util.hash_array(vocabulary.to_numpy(dtype=str).astype(object))
+
+
+def _fmix(h: np.ndarray) -> np.ndarray:
+    h = h ^ (h >> np.uint64(33))
+    h = h * np.uint64(0xff51afd7ed558ccd)
+    return h ^ (h >> np.uint64(33))
+
+
+def _hashed_ngrams(codes: np.ndarray, starts: np.ndarray, stops: np.ndarray, activity_hashes: np.ndarray, n: int,
+                   n_features: int, signed: bool) -> sparse.csr_matrix:
+    """
+    Case x feature matrix of the hashed 1..n-grams of the event ranges [start, stop) of the given activity codes.
+    """
+    lengths = stops - starts
+    total = lengths.sum()
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    event_codes = codes[positions]
+    event_hashes = np.where(event_codes >= 0, activity_hashes[np.maximum(event_codes, 0)] if len(activity_hashes)
+                            else np.uint64(0), np.uint64(0)).astype(np.uint64)
+    # number of events from an event until the end of its case
+    remaining = np.repeat(stops, lengths) - positions
+
+    all_rows, all_cols, all_values = [], [], []
+    h = np.zeros(total, dtype=np.uint64)
+    for k in range(1, n + 1):
+        # hash of the k-gram starting at every event, built from the (k-1)-gram
+        h = (h[:total - k + 1] * _HASH_PRIME) ^ event_hashes[k - 1:]
+        valid = remaining[:total - k + 1] >= k
+        gram_hashes = _fmix(h[valid] ^ np.uint64(k))
+        all_rows.append(rows[:total - k + 1][valid])
+        all_cols.append((gram_hashes % np.uint64(n_features)).astype(np.int64))
+        all_values.append(np.where(gram_hashes >> np.uint64(63), -1., 1.) if signed else np.ones(len(gram_hashes)))
+
+    mat = sparse.csr_matrix((np.concatenate(all_values), (np.concatenate(all_rows), np.concatenate(all_cols))),
+                            shape=(len(starts), n_features))
+    mat.sum_duplicates()
+    mat.eliminate_zeros()
+    return mat
+
+
+def iter_hashed_ngrams(log, n: int = 3, n_features: int = 2 ** 16, signed: bool = True,
+                       batch_size: int = 10_000) -> Iterator[sparse.csr_matrix]:
+    """
+    Vectorize the activity sequences of the cases of a log by their hashed n-grams, batch by batch.
+    The vectors of the cases of different logs are comparable, no vocabulary of n-grams is built.
+    :param log: event log (or filtered view), or its variants (`log.variants`) to vectorize every distinct sequence once
+    :param n: n-grams of length 1 up to n are used
+    :param n_features: dimension of the vectors
+    :param signed: add or subtract an n-gram depending on a bit of its hash, so collisions cancel out on average
+    :param batch_size: number of cases per batch
+    :return: iterator of sparse matrices with a row per case (in order of `log.case_index`) or variant
+    """
+    codes, offsets, activities = _sequences(log)
+    activity_hashes = _activity_hashes(activities)
+    n_cases = len(offsets) - 1
+    for first in range(0, n_cases, batch_size):
+        last = min(first + batch_size, n_cases)
+        yield _hashed_ngrams(codes, offsets[first:last], offsets[first + 1:last + 1], activity_hashes, n,
+                             n_features, signed)
+
+
+def vectorize_hashed_ngrams(log, n: int = 3, n_features: int = 2 ** 16, signed: bool = True,
+                            batch_size: int = 10_000) -> sparse.csr_matrix:
+    """
+    Hashed n-gram vectors of all cases of a log, see `iter_hashed_ngrams`.
+    """
+    batches = list(iter_hashed_ngrams(log, n, n_features, signed, batch_size))
+    return sparse.vstack(batches, format='csr') if batches else sparse.csr_matrix((0, n_features))
+
+
+def vectorize_traces_hashed(traces: pd.Series, n: int = 3, n_features: int = 2 ** 16,
+                            signed: bool = True) -> sparse.csr_matrix:
+    """
+    Hashed n-gram vectors of traces which are views on the same log, see `iter_hashed_ngrams`.
+    """
+    if len(traces) == 0:
+        return sparse.csr_matrix((0, n_features))
+    first = traces.iloc[0]
+    codes = first._df[first.activity_attr].cat.codes.to_numpy()
+    starts = np.fromiter((t._start for t in traces), dtype=np.int64, count=len(traces))
+    stops = np.fromiter((t._stop for t in traces), dtype=np.int64, count=len(traces))
+    return _hashed_ngrams(codes, starts, stops, _activity_hashes(first.activity_vocabulary), n, n_features, signed)
+
+
+def unique_rows(vectors: sparse.csr_matrix):
+    """
+    Identical rows of a sparse matrix, e.g. of traces with the same activity counts.
+    :return: tuple with the unique rows, the position of the unique row of every row and the number of rows
+             per unique row
+    """
+    vectors = sparse.csr_matrix(vectors)
+    vectors.sort_indices()
+    indptr, indices, data = vectors.indptr, vectors.indices, vectors.data
+    keys = [indices[start:stop].tobytes() + b'|' + data[start:stop].tobytes()
+            for start, stop in zip(indptr[:-1], indptr[1:])]
+    inverse, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    first = np.full(len(uniques), len(keys), dtype=np.int64)
+    np.minimum.at(first, inverse, np.arange(len(keys)))
+    return vectors[first], inverse, np.bincount(inverse, minlength=len(uniques))
@@ -1,35 +1,75 @@
 import functools
 import os
 from pathlib import Path
-from typing import Callable, List, Optional
+from typing import Callable, List, Optional, Tuple, Union
 
 import pandas as pd
 
 _DATA_DIR = Path('./data/')
+# supported file formats for data sets in the order of preference
+_DATA_SUFFIXES = ('.parquet', '.csv')
 
 
 def get_available_datasets(path="raw") -> List[str]:
-    return os.listdir(_DATA_DIR / path)
+    """
+    List the data sets within a sub-directory of the data-directory.
+    Data sets available in several formats are only listed in the preferred (columnar) format.
+    """
+    files = sorted(os.listdir(_DATA_DIR / path))
+    stems = {Path(f).stem for f in files if Path(f).suffix == _DATA_SUFFIXES[0]}
+    return [f for f in files if Path(f).suffix == _DATA_SUFFIXES[0] or Path(f).stem not in stems]
 
 
 def filter_dt_session(df: pd.DataFrame) -> pd.DataFrame:
     return df[df.ua_type != "Xhr"].drop(['ua_type'], axis=1)
 
 
-@functools.lru_cache()
-def load_csv_data(file_name: str, src_dir: str = 'raw', prep_fn: Optional[Callable] = None) -> pd.DataFrame:
+def write_parquet(df: pd.DataFrame, dest_file: Union[Path, str], dictionary_columns: Optional[List[str]] = None) -> None:
+    """
+    Store a data frame in the columnar parquet format. Timestamps keep their native type.
+    :param df: data to store
+    :param dest_file: destination file
+    :param dictionary_columns: columns to store dictionary encoded (as categories), defaults to all string columns
     """
-    Read csv file from directory.
+    if dictionary_columns is None:
+        dictionary_columns = list(df.select_dtypes(include=['object', 'string']).columns)
+    df = df.astype({c: 'category' for c in dictionary_columns if c in df})
+    df.to_parquet(dest_file, index=False)
+
+
+def save_data(df: pd.DataFrame, file_name: str, dest_dir: str = 'processed') -> Path:
     """
-    _DATA_DIR = Path('./data/')
-    # allow_cache = src_dir == "raw"
-    #
-    # if allow_cache:  # try 'caching' raw file to avoid applying the prep_fn needlessly
-    #     filtered_file = _DATA_DIR / 'interim' / file_name
-    #     if os.path.exists(filtered_file):
-    #         return pd.read_csv(filtered_file)
+    Store data within the data-directory using the columnar format.
+    :return: path of the created file
+    """
+    dest_file = (_DATA_DIR / dest_dir / file_name).with_suffix(_DATA_SUFFIXES[0])
+    write_parquet(df, dest_file)
+    return dest_file
+
 
-    df = pd.read_csv(_DATA_DIR / src_dir / file_name)
+def read_data_file(path: Union[Path, str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read a data file based on its extension. Parquet files are memory mapped and only the requested columns are read.
+    :param path: csv or parquet file
+    :param columns: columns to read, defaults to all
+    """
+    path = Path(path)
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    elif path.suffix == '.csv':
+        return pd.read_csv(path, usecols=columns)
+    else:
+        raise NotImplementedError(f"Extension '{path.suffix}' is not recognized")
+
+
+@functools.lru_cache()
+def load_data(file_name: str, src_dir: str = 'raw', prep_fn: Optional[Callable] = None,
+              columns: Optional[Tuple[str, ...]] = None) -> pd.DataFrame:
+    """
+    Read a data file (csv or parquet) from a sub-directory of the data-directory.
+    :param columns: columns to read, defaults to all
+    """
+    df = read_data_file(_DATA_DIR / src_dir / file_name, list(columns) if columns else None)
     if prep_fn is not None:
         df_filtered = prep_fn(df)
         print(f"Filtered out {len(df) - len(df_filtered)} entries")
@@ -1,26 +1,112 @@
-import itertools
-from typing import Optional, List
+import hashlib
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Union
 
 import altair as alt
+import numpy as np
 import pandas as pd
 from graphviz import Digraph
 
+from src.event_log import derived
+from src.event_log.eventlog import EventLog
+from src.pmtools.dfg import DirectlyFollowsGraph
+from src.pmtools.matrices import create_heuristic_matrix, get_dfg
 
-def create_directly_follows_graph(footprint_matrix: pd.DataFrame) -> Digraph:
+_DOT_CACHE_SIZE = 64
+CASE_ORDERS = ('start', 'duration', 'case id')
+_dot_cache: 'OrderedDict[tuple, str]' = OrderedDict()
+
+
+def _add_edges(dot: Digraph, nodes: pd.Index, weights: np.ndarray, keep: np.ndarray) -> None:
+    for row, col in zip(*np.nonzero(keep)):
+        dot.edge(nodes[row], nodes[col], label=f"{weights[row, col]:.2f}")
+
+
+def create_directly_follows_graph(footprint_matrix: Union[pd.DataFrame, DirectlyFollowsGraph]) -> Digraph:
+    if isinstance(footprint_matrix, DirectlyFollowsGraph):
+        footprint_matrix = create_heuristic_matrix(footprint_matrix)
     dot = Digraph(comment='Directly Follows Graph')
 
     nodes = footprint_matrix.columns
     for n in nodes:
         dot.node(n)
 
-    for row, col in itertools.product(nodes, nodes):
-        fwd_transition = footprint_matrix.loc[row, col]
-        if fwd_transition > 0:
-            dot.edge(row, col, label=f"{fwd_transition:.2f}")
-
+    weights = footprint_matrix.to_numpy()
+    _add_edges(dot, nodes, weights, weights > 0)
     return dot
 
 
+def _dfg_fingerprint(dfg: DirectlyFollowsGraph) -> str:
+    h = hashlib.sha1(repr(list(map(str, dfg.activities))).encode('utf-8'))
+    h.update(np.ascontiguousarray(dfg.activity_counts).tobytes())
+    h.update(np.ascontiguousarray(dfg.pair_counts).tobytes())
+    return h.hexdigest()
+
+
+def _select_edges(dfg: DirectlyFollowsGraph, top_k: Optional[int], min_dependency_pct: float,
+                  min_frequency_pct: float, min_activity_pct: float):
+    """
+    :return: tuple with the kept activities, their dependency matrix and the mask of kept edges
+    """
+    activities, counts = dfg.get_transition_counts()
+    activity_counts = dfg.activity_counts[dfg.activity_counts > 0]
+    dependencies = (counts - counts.T) / (counts + counts.T + 1)
+
+    if len(activities) and min_activity_pct > 0:
+        kept_nodes = activity_counts >= np.percentile(activity_counts, min_activity_pct)
+        activities = activities[kept_nodes]
+        counts = counts[np.ix_(kept_nodes, kept_nodes)]
+        dependencies = dependencies[np.ix_(kept_nodes, kept_nodes)]
+
+    keep = dependencies > 0
+    if keep.any() and min_dependency_pct > 0:
+        keep &= dependencies >= np.percentile(dependencies[keep], min_dependency_pct)
+    if keep.any() and min_frequency_pct > 0:
+        keep &= counts >= np.percentile(counts[keep], min_frequency_pct)
+    if top_k is not None and keep.sum() > top_k:
+        # strongest edges by frequency, ties broken by dependency
+        candidates = np.flatnonzero(keep)
+        order = np.lexsort((-dependencies.flat[candidates], -counts.flat[candidates]))
+        keep = np.zeros_like(keep)
+        keep.flat[candidates[order[:top_k]]] = True
+    return activities, dependencies, keep
+
+
+def create_filtered_directly_follows_graph(log: Union[EventLog, DirectlyFollowsGraph], top_k: Optional[int] = None,
+                                           min_dependency_pct: float = 0, min_frequency_pct: float = 0,
+                                           min_activity_pct: float = 0, hide_isolated: bool = True) -> str:
+    """
+    Directly-follows graph restricted to its most relevant activities and edges, for logs with many activities.
+    The DOT source is cached per graph and threshold setting.
+    :param log: the log or its directly-follows graph
+    :param top_k: only keep the k most frequent edges
+    :param min_dependency_pct: only keep edges with a dependency measure above this percentile (0-100)
+    :param min_frequency_pct: only keep edges with a frequency above this percentile (0-100)
+    :param min_activity_pct: only keep activities with a frequency above this percentile (0-100)
+    :param hide_isolated: drop activities without any kept edge
+    :return: DOT source of the graph
+    """
+    dfg = get_dfg(log)
+    key = (_dfg_fingerprint(dfg), top_k, min_dependency_pct, min_frequency_pct, min_activity_pct, hide_isolated)
+    if key in _dot_cache:
+        _dot_cache.move_to_end(key)
+        return _dot_cache[key]
+
+    activities, dependencies, keep = _select_edges(dfg, top_k, min_dependency_pct, min_frequency_pct,
+                                                   min_activity_pct)
+    dot = Digraph(comment='Directly Follows Graph')
+    nodes = activities.astype(str)
+    shown = (keep.any(axis=0) | keep.any(axis=1)) if hide_isolated else np.ones(len(nodes), dtype=bool)
+    for n in nodes[shown]:
+        dot.node(n)
+    _add_edges(dot, nodes, dependencies, keep)
+
+    _dot_cache[key] = dot.source
+    if len(_dot_cache) > _DOT_CACHE_SIZE:
+        _dot_cache.popitem(last=False)
+    return dot.source
+
+
 def create_dotted_chart(df: pd.DataFrame, color_attribute: str, x_attr: str, y_attr: str, y_sort: str, tooltip: Optional[List] = None) -> alt.Chart:
     # c = alt.Chart(df).mark_line().encode(
     #     alt.X(f"{x_attr}:T",  axis=alt.Axis(labelAngle=-45)),
@@ -48,4 +134,131 @@ def create_dotted_chart(df: pd.DataFrame, color_attribute: str, x_attr: str, y_a
         # ).transform_filter(
         #     alt.datum.Entity != 'All natural disasters'
     ).interactive()
-    return c
\ No newline at end of file
+    return c
+
+
+def get_case_ranks(log: EventLog, order: str = 'start') -> np.ndarray:
+    """
+    Position of every case (in order of the case ordinals) on the y-axis of a dotted chart.
+    :param order: 'start' (time of the first event), 'duration' (time span of the case) or 'case id'
+    """
+    if order not in CASE_ORDERS:
+        raise ValueError(f"Unknown case order '{order}', expected one of {CASE_ORDERS}")
+    offsets = log._offsets
+    if order == 'start':
+        timestamps = derived.to_milliseconds(log.get_column(log.ts_attr))[:offsets[-1]]
+        keys = np.fmin.reduceat(timestamps, offsets[:-1]) if len(offsets) > 1 else np.zeros(0)
+    elif order == 'duration':
+        keys = log.case_features['span'].to_numpy()
+    else:
+        keys = np.arange(len(offsets) - 1)  # the ordinals follow the sorted case ids
+    ranks = np.empty(len(keys), dtype=np.int64)
+    ranks[np.argsort(keys, kind='stable')] = np.arange(len(keys))
+    return ranks
+
+
+def _x_values(values: pd.Series) -> Tuple[np.ndarray, object]:
+    """
+    :return: tuple with the x-values as ms (relative to the origin for timestamps) and the origin (None for numbers)
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return derived.to_milliseconds(values), values.min()
+    return values.to_numpy(dtype=float, na_value=np.nan), None
+
+
+def _to_ms(value, origin) -> float:
+    return (pd.Timestamp(value) - origin) / pd.Timedelta(1, 'ms') if origin is not None else float(value)
+
+
+def create_dotted_chart_data(log: EventLog, color_attribute: str, x_attr: str, case_order: str = 'start',
+                             x_range: Optional[Tuple] = None, case_range: Optional[Tuple[int, int]] = None,
+                             max_points: int = 5000, n_case_bins: Optional[int] = None,
+                             columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, bool]:
+    """
+    Data of a dotted chart with a bounded size: the events in the visible range are returned as points if there
+    are at most `max_points` of them, otherwise they are binned into time x case-rank buckets.
+    :param log: the log to show
+    :param color_attribute: attribute coloring the events (the most frequent value of a bucket)
+    :param x_attr: attribute on the x-axis (timestamps or numbers)
+    :param case_order: order of the cases on the y-axis, see `get_case_ranks`
+    :param x_range: visible (inclusive) range of the x-axis, defaults to all events
+    :param case_range: visible (inclusive) range of case ranks, defaults to all cases
+    :param max_points: maximal number of events shown as points, also bounds the number of buckets
+    :param n_case_bins: number of buckets along the cases, defaults to sqrt(max_points / 2); the x-axis gets the
+                        remaining max_points // n_case_bins buckets
+    :param columns: further attributes of the points (e.g. for tooltips)
+    :return: tuple with the frame and whether it is binned. Points have the shown attributes and 'case_rank';
+             buckets have x_attr (start of the bucket), 'case_rank' (first rank of the bucket), 'count',
+             color_attribute (most frequent value) and 'share' (of the most frequent value)
+    """
+    n_traced = log._offsets[-1]
+    ranks = get_case_ranks(log, case_order)[log.get_event_case_ordinals()[:n_traced]]
+    x, origin = _x_values(log.get_column(x_attr))
+    x = x[:n_traced]
+
+    visible = ~np.isnan(x)
+    x_lo, x_hi = (np.nanmin(x), np.nanmax(x)) if visible.any() else (0., 0.)
+    if x_range is not None:
+        x_lo, x_hi = _to_ms(x_range[0], origin), _to_ms(x_range[1], origin)
+        visible &= (x >= x_lo) & (x <= x_hi)
+    r_lo, r_hi = (0, max(len(log.case_index) - 1, 0)) if case_range is None else case_range
+    visible &= (ranks >= r_lo) & (ranks <= r_hi)
+    positions = np.flatnonzero(visible)
+
+    if len(positions) <= max_points:
+        attrs = list(dict.fromkeys([x_attr, color_attribute, log.case_id_attr] + list(columns or [])))
+        points = pd.DataFrame({attr: log.get_column(attr).to_numpy()[positions] for attr in attrs})
+        points['case_rank'] = ranks[positions]
+        return points, False
+
+    # at most max_points buckets, a case bucket never covers less than one case
+    if n_case_bins is None:
+        n_case_bins = int(np.sqrt(max_points / 2))
+    n_case_bins = int(np.clip(n_case_bins, 1, min(r_hi - r_lo + 1, max_points)))
+    n_x_bins = max(max_points // n_case_bins, 1)
+    x_bins = np.clip(((x[positions] - x_lo) / max(x_hi - x_lo, 1e-9) * n_x_bins).astype(np.int64), 0, n_x_bins - 1)
+    case_bins = (ranks[positions] - r_lo) * n_case_bins // (r_hi - r_lo + 1)
+    buckets = x_bins * n_case_bins + case_bins
+
+    colors = log.get_column(color_attribute).iloc[:n_traced].iloc[positions]
+    color_codes, color_values = pd.factorize(colors)
+    color_codes = color_codes + 1  # missing values (-1) are a color of their own
+    n_colors = len(color_values) + 1
+    keys, key_counts = np.unique(buckets * n_colors + color_codes, return_counts=True)
+    key_buckets = keys // n_colors
+    # per bucket the color with the highest count is the last one after sorting by bucket and count
+    order = np.lexsort((key_counts, key_buckets))
+    last = np.flatnonzero(np.append(key_buckets[order][1:] != key_buckets[order][:-1], True))
+    dominant = order[last]
+
+    used, counts = np.unique(buckets, return_counts=True)
+    bucket_x = x_lo + used // n_case_bins * (x_hi - x_lo) / n_x_bins
+    dominant_codes = keys[dominant] % n_colors
+    binned = pd.DataFrame({
+        x_attr: origin + pd.to_timedelta(bucket_x, unit='ms') if origin is not None else bucket_x,
+        'case_rank': r_lo + (used % n_case_bins) * (r_hi - r_lo + 1) // n_case_bins,
+        'count': counts,
+        color_attribute: np.where(dominant_codes > 0, color_values.to_numpy(dtype=object)[np.maximum(dominant_codes - 1, 0)]
+                                  if len(color_values) else None, None),
+        'share': key_counts[dominant] / counts,
+    })
+    return binned, True
+
+
+def create_binned_dotted_chart(df: pd.DataFrame, color_attribute: str, x_attr: str) -> alt.Chart:
+    """
+    Dotted chart of the buckets of `create_dotted_chart_data`, the size of a dot shows the number of its events.
+    """
+    x_type = 'T' if pd.api.types.is_datetime64_any_dtype(df[x_attr]) else 'Q'
+    return alt.Chart(df).mark_circle(
+        opacity=0.8
+    ).encode(
+        alt.X(f"{x_attr}:{x_type}"),
+        alt.Y("case_rank:Q", title='Case (rank)', scale=alt.Scale(reverse=True)),
+        size=alt.Size('count:Q', legend=None),
+        color=alt.Color(color_attribute, legend=None),
+        tooltip=[x_attr, 'case_rank', 'count', color_attribute, 'share']
+    ).properties(
+        width=1000,
+        height=800
+    )
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.event_log import derived
+from src.event_log.eventlog import EventLog
+from src.event_log.trace import Trace
+
+
+def _log(df: pd.DataFrame) -> EventLog:
+    return EventLog(df, case_id_attr='case', activity_attr='activity', timestamp_attr='ts', duration_attr='duration',
+                    ts_parse_params={'unit': 'ms'})
+
+
+@pytest.fixture
+def log() -> EventLog:
+    # cases are interleaved in the input and sorted (stable) by id in the log
+    return _log(pd.DataFrame({
+        'case': ['b', 'a', 'b', 'a', 'a', 'c'],
+        'activity': ['x', 'x', 'y', 'y', 'z', 'x'],
+        'ts': [1000, 0, 4000, 500, 2500, 7000],
+        'duration': [100., 50., 300., 0., 200., 10.],
+    }))
+
+
+def _context(ts, duration, offsets) -> derived.DerivationContext:
+    df = pd.DataFrame({'ts': ts, 'duration': duration})
+    return derived.DerivationContext(df, np.asarray(offsets), 'ts', 'duration')
+
+
+def test_context_arrays():
+    ctx = _context([0., 10., 5., 7., np.nan], [1., 2., 3., 4., 5.], [0, 2, 4])
+    assert ctx.n_traced == 4
+    np.testing.assert_array_equal(ctx.starts, [0, 2])
+    np.testing.assert_array_equal(ctx.lengths, [2, 2])
+    np.testing.assert_array_equal(ctx.timestamps, [0., 10., 5., 7.])
+    np.testing.assert_array_equal(ctx.durations, [1., 2., 3., 4.])
+    np.testing.assert_array_equal(ctx.per_case(np.array([1, 2])), [1, 1, 2, 2])
+    # events without a case are padded with NaN
+    np.testing.assert_array_equal(ctx.to_column(np.array([1., 2., 3., 4.])), [1., 2., 3., 4., np.nan])
+
+
+def test_context_without_duration_column():
+    ctx = derived.DerivationContext(pd.DataFrame({'ts': [0., 1.]}), np.array([0, 2]), 'ts', 'duration')
+    np.testing.assert_array_equal(ctx.durations, [0., 0.])
+
+
+def test_derivations_of_multiple_cases():
+    ctx = _context([0., 500., 2500., 1000., 4000.], [50., 0., 200., 100., 300.], [0, 3, 5])
+    np.testing.assert_array_equal(derived.time_passed(ctx), [0., 500., 2500., 0., 3000.])
+    np.testing.assert_array_equal(derived.trace_position(ctx), [0, 1, 2, 0, 1])
+    np.testing.assert_array_equal(derived.time_since_last(ctx), [0., 500., 2000., 0., 3000.])
+    np.testing.assert_array_equal(derived.trace_length(ctx), [3, 3, 3, 2, 2])
+    # from the first event until the end of the last one
+    np.testing.assert_array_equal(derived.case_durations(ctx), [2700., 3300.])
+    np.testing.assert_array_equal(derived.trace_duration(ctx), [2700.] * 3 + [3300.] * 2)
+
+
+def test_single_event_cases():
+    ctx = _context([3., 8.], [2., np.nan], [0, 1, 2])
+    np.testing.assert_array_equal(derived.time_passed(ctx), [0., 0.])
+    np.testing.assert_array_equal(derived.time_since_last(ctx), [0., 0.])
+    # a missing duration of the last event counts as 0
+    np.testing.assert_array_equal(derived.case_durations(ctx), [2., 0.])
+
+
+def test_missing_timestamps():
+    ctx = _context([0., np.nan, 30., np.nan, 5.], [0.] * 5, [0, 3, 5])
+    np.testing.assert_array_equal(derived.time_passed(ctx), [0., np.nan, 30., np.nan, np.nan])
+    np.testing.assert_array_equal(derived.time_since_last(ctx), [0., np.nan, np.nan, 0., np.nan])
+    # a case is only as reliable as the timestamps of its first and last event
+    np.testing.assert_array_equal(derived.case_durations(ctx), [30., np.nan])
+    np.testing.assert_array_equal(derived.trace_position(ctx), [0, 1, 2, 0, 1])
+
+
+def test_derived_columns_of_log(log):
+    df = log._df
+    assert list(df['case']) == ['a', 'a', 'a', 'b', 'b', 'c']
+    np.testing.assert_array_equal(df[derived.TIME_PASSED], [0., 500., 2500., 0., 3000., 0.])
+    np.testing.assert_array_equal(df[derived.TRACE_POSITION], [0, 1, 2, 0, 1, 0])
+    np.testing.assert_array_equal(df[derived.TIME_SINCE_LAST], [0., 500., 2000., 0., 3000., 0.])
+    np.testing.assert_array_equal(df[derived.TRACE_LENGTH], [3, 3, 3, 2, 2, 1])
+    np.testing.assert_array_equal(df[derived.TRACE_DURATION], [2700.] * 3 + [3300.] * 2 + [10.])
+
+
+def test_events_without_case_get_nan():
+    log = _log(pd.DataFrame({
+        'case': ['a', None, 'a'],
+        'activity': ['x', 'y', 'z'],
+        'ts': [0, 100, 200],
+        'duration': [0., 0., 0.],
+    }))
+    df = log._df
+    assert df['case'].isna().iloc[-1]
+    np.testing.assert_array_equal(df[derived.TIME_PASSED], [0., 200., np.nan])
+    np.testing.assert_array_equal(df[derived.TRACE_DURATION], [200., 200., np.nan])
+
+
+def test_trace_duration_is_positive(log):
+    # the duration runs from the start of the first event until the end of the last one (not the other way round)
+    durations = [trace.duration for trace in log.traces]
+    assert durations == [2700., 3300., 10.]
+    df = log._df[['case', 'activity', 'ts', 'duration']]
+    assert Trace(df, log._trace_attrs, 0, 3).duration == 2700.
+
+
+def test_register_derived_attr(log):
+    log.register_derived_attr('is_last', lambda ctx: derived.trace_position(ctx) == ctx.per_case(ctx.lengths - 1))
+    assert list(log._df['is_last']) == [False, False, True, False, True, True]
+
+
+def test_events_are_sorted_by_time_within_cases():
+    log = _log(pd.DataFrame({
+        'case': ['a', 'b', 'a', 'a', 'b'],
+        'activity': ['z', 'y', 'x', 'y', 'x'],
+        'ts': [3000, 900, 1000, 1000, 100],
+        'duration': [0.] * 5,
+    }))
+    df = log._df
+    # equal timestamps keep their order of the file
+    assert list(df['activity']) == ['x', 'y', 'z', 'x', 'y']
+    np.testing.assert_array_equal(df[derived.TIME_PASSED], [0., 0., 2000., 0., 800.])
+    np.testing.assert_array_equal(df[derived.TIME_SINCE_LAST], [0., 0., 2000., 0., 800.])
+    np.testing.assert_array_equal(log.case_features['span'], [2000., 800.])
+    np.testing.assert_array_equal(df[derived.TRACE_DURATION], [2000.] * 3 + [800.] * 2)
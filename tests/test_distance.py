@@ -0,0 +1,27 @@
+import numpy as np
+from scipy import sparse
+
+from src.pmtools.distance import edit_distances, repeat_distances
+
+
+def _codes(*sequences):
+    width = max(len(s) for s in sequences)
+    codes = np.full((len(sequences), width), -1)
+    for i, s in enumerate(sequences):
+        codes[i, :len(s)] = [ord(c) for c in s]
+    return codes, np.array([len(s) for s in sequences])
+
+
+def test_edit_distances():
+    a, a_len = _codes('kitten', 'abc', '', 'ab')
+    b, b_len = _codes('sitting', 'abc', 'xy', 'ba')
+    np.testing.assert_array_equal(edit_distances(a, a_len, b, b_len), [3, 0, 2, 2])
+    np.testing.assert_array_equal(edit_distances(a, a_len, b, b_len, damerau=True), [3, 0, 2, 1])
+    np.testing.assert_array_equal(edit_distances(a, a_len, b, b_len, max_distance=1), [2, 0, 2, 2])
+
+
+def test_repeat_distances():
+    eps = np.finfo(float).eps
+    distances = sparse.csr_matrix(np.array([[0., 1.], [1., 0.]]))
+    repeated = repeat_distances(distances, np.array([0, 0, 1])).toarray()
+    np.testing.assert_array_equal(repeated, [[0., eps, 1.], [eps, 0., 1.], [1., 1., 0.]])
@@ -0,0 +1,60 @@
+import numpy as np
+from scipy import sparse
+
+from src.pmtools import mcl
+
+
+def _two_groups(n: int) -> np.ndarray:
+    # two fully connected groups of n nodes with a weak link between them
+    mat = np.zeros((2 * n, 2 * n))
+    mat[:n, :n] = 1
+    mat[n:, n:] = 1
+    mat[0, n] = mat[n, 0] = 0.1
+    return mat
+
+
+def test_two_groups():
+    result = mcl.run_mcl(_two_groups(4))
+    assert mcl.get_clusters(result) == [(0, 1, 2, 3), (4, 5, 6, 7)]
+
+
+def test_sparse_input():
+    result = mcl.run_mcl(sparse.csr_matrix(_two_groups(4)))
+    assert mcl.get_clusters(result) == [(0, 1, 2, 3), (4, 5, 6, 7)]
+
+
+def test_weighted_nodes_are_not_pruned():
+    # every single entry is far below the pruning threshold, but the weighted mass of the columns is not
+    result = mcl.run_mcl(np.ones((5, 5)), node_weights=[500] * 5)
+    assert result.nnz > 0
+    assert mcl.get_clusters(result) == [(0, 1, 2, 3, 4)]
+
+
+def test_weighted_nodes_match_duplicates():
+    # a node of weight w clusters like w identical nodes
+    weights = np.array([3, 1, 2, 1])
+    mat = _two_groups(2)
+    weighted = mcl.get_clusters(mcl.run_mcl(mat, node_weights=weights))
+
+    node_of = np.repeat(np.arange(len(weights)), weights)
+    duplicated = mcl.get_clusters(mcl.run_mcl(mat[np.ix_(node_of, node_of)]))
+    assert sorted(tuple(sorted(set(node_of[list(c)].tolist()))) for c in duplicated) == weighted
+
+
+def test_many_weighted_variants():
+    # two variants standing for thousands of sessions still form two clusters
+    mat = np.array([[1., 0.2], [0.2, 1.]])
+    result = mcl.run_mcl(mat, node_weights=[1500, 1500], loop_value=0)
+    assert mcl.get_clusters(result) == [(0,), (1,)]
+
+
+def test_prune_keeps_column_maximum():
+    mat = sparse.csc_matrix(np.array([[1e-4, 0.5], [2e-4, 0.5]]))
+    pruned = mcl._prune(mat, np.ones(2), threshold=0.001, top_k=None)
+    np.testing.assert_array_equal(pruned.toarray(), [[0, 0.5], [2e-4, 0.5]])
+
+
+def test_prune_top_k():
+    mat = sparse.csc_matrix(np.array([[0.5, 0.1], [0.3, 0.6], [0.2, 0.3]]))
+    pruned = mcl._prune(mat, np.ones(3), threshold=0., top_k=1)
+    np.testing.assert_array_equal(pruned.toarray(), [[0.5, 0], [0, 0.6], [0, 0]])
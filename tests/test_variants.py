@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.event_log.eventlog import EventLog
+from src.preprocessing.vectorize import vectorize_hashed_ngrams, vectorize_log
+
+
+@pytest.fixture
+def log() -> EventLog:
+    sequences = {'1': 'ab', '2': 'abc', '3': 'ab', '4': 'x', '5': 'ab', '6': 'abc'}
+    rows = [(case, activity, i) for case, seq in sequences.items() for i, activity in enumerate(seq)]
+    df = pd.DataFrame(rows, columns=['case', 'activity', 'ts'])
+    return EventLog(df, case_id_attr='case', activity_attr='activity', timestamp_attr='ts')
+
+
+def test_variants(log):
+    variants = log.variants
+    assert [variants.get_activities(i) for i in range(len(variants))] == [['a', 'b'], ['a', 'b', 'c'], ['x']]
+    np.testing.assert_array_equal(variants.counts, [3, 2, 1])
+    np.testing.assert_array_equal(variants.broadcast(['ab', 'abc', 'x']), ['ab', 'abc', 'ab', 'x', 'ab', 'abc'])
+
+
+def test_repeat_capped(log):
+    rows = log.variants.repeat_capped(2)
+    np.testing.assert_array_equal(rows, [0, 0, 1, 1, 2])
+    np.testing.assert_array_equal(np.searchsorted(rows, np.arange(3)), [0, 2, 4])
+
+
+def test_vectorize_variants(log):
+    variants = log.variants
+    per_case = vectorize_log(log)
+    assert (vectorize_log(variants)[variants.case_variant] != per_case).nnz == 0
+    hashed = vectorize_hashed_ngrams(log, n_features=64)
+    assert (vectorize_hashed_ngrams(variants, n_features=64)[variants.case_variant] != hashed).nnz == 0
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from src.event_log.reader import XES_ACTIVITY, XES_CASE_ID, XES_TIMESTAMP, XesReader
+from src.event_log.writer import XesWriter
+
+_LOG = """<?xml version="1.0" encoding="UTF-8" ?>
+<log xes.version="1.0">
+<trace><string key="concept:name" value="c1"/>
+<event><string key="concept:name" value="a"/><date key="time:timestamp" value="2020-01-01T00:00:00.000+00:00"/>
+<int key="cost" value="5"/><boolean key="ok" value="true"/></event>
+<event><string key="concept:name" value="b"/><date key="time:timestamp" value="2020-01-01T00:01:00.000+00:00"/></event>
+</trace>
+</log>
+"""
+
+
+def test_missing_values_keep_their_type(tmp_path):
+    src_file = tmp_path / 'log.xes'
+    src_file.write_text(_LOG)
+    log = XesReader().read(src_file)
+    assert log._df['cost'].dtype == 'Int64'
+    assert log._df['ok'].dtype == 'boolean'
+    assert log._df['cost'].isna().sum() == 1
+
+    dest_file = tmp_path / 'copy.xes'
+    XesWriter().write(log, dest_file)
+    assert '<int key="cost" value="5"/>' in dest_file.read_text()
+    copy = XesReader().read(dest_file)
+    pd.testing.assert_series_equal(copy._df['cost'], log._df['cost'])
+    pd.testing.assert_series_equal(copy._df['ok'], log._df['ok'])
+
+
+def test_log_without_traces(tmp_path):
+    src_file = tmp_path / 'empty.xes'
+    src_file.write_text('<?xml version="1.0" encoding="UTF-8" ?>\n<log xes.version="1.0">\n</log>\n')
+    log = XesReader().read(src_file)
+    assert len(log) == 0
+    assert len(log.case_index) == 0
+    assert {XES_CASE_ID, XES_ACTIVITY, XES_TIMESTAMP} <= set(log._df.columns)
@@ -9,31 +9,28 @@ import pickle
 import re
 
 from src.event_log.eventlog import EventLog
-from src.event_log.trace import Trace
-from src.preprocessing import filter_by_session_length
-from src.preprocessing.vectorize import create_corpus, create_np_matrix, vectorize_activities
+from src.pmtools.distance import edit_distances, pad_codes, pairwise_edit_distances, repeat_distances
+from src.pmtools import parallel
+from src.pmtools.outliers import OutlierModel
 import src.utils.io as io
 from ui.components import attribute_mapper
 
 DATA_PATH = Path("data/interim")
 DATA_PATH_Processed = Path("data/processed")
+# models are kept apart from the processed data sets, which are all read as logs
+DATA_PATH_Models = Path("data/models")
+# dimension of the hashed n-gram vectors the sessions are clustered on
+N_FEATURES = 512
+OUTLIER_THRESHOLD = 0.6
 
 
 def calc_distance(trace1, trace2) -> int:
-    f"""
-     trace1: {trace1}. 
-    
-     trace2: {trace2}"""
-
-    f"length t1: {len(trace1)} - length t2: {len(trace2)}"
-
-    distance = abs(len(trace1) - len(trace2))
-
-    for t1, t2 in zip(trace1, trace2):
-        if t1 != t2:
-            distance = distance + 1
-
-    return distance
+    """
+    Edit distance between the activities of two traces
+    """
+    codes, _ = pd.factorize(pd.Series(list(trace1) + list(trace2), dtype=object))
+    t1, t2 = codes[:len(trace1)][None, :], codes[len(trace1):][None, :]
+    return int(edit_distances(t1, [len(trace1)], t2, [len(trace2)])[0])
 
 def test_calc_distance():
     t1 = ["a", "a", "c", "a", "a", "a"]
@@ -53,13 +50,9 @@ def write_outliers_to_pickle(outliers, file_name):
     with open(DATA_PATH_Processed / file_name, 'wb') as f:
         pickle.dump(outliers, f)
 
-def time_anomaly(df, file_name):
-    duration = df.groupby("visitId").agg({"duration": ["sum"]})
-    count = df.groupby("visitId").agg({"activity":["count"]})
-    c = pd.concat([duration ,count], axis = 1, sort= False)
-    calc = c.iloc[:, 0] / c.iloc[:, 1]
-    c = pd.concat([c, calc], axis = 1, sort = False)
-
+def time_anomaly(log: EventLog, file_name):
+    features = parallel.get_case_features(log)
+    c = features[["total_duration", "events", "mean_duration"]]
     c.columns = ["duration", "count", "metric"]
 
     c = c.sort_values(by=["metric"], ascending = True)
@@ -67,14 +60,64 @@ def time_anomaly(df, file_name):
     c = c[c["metric"] < 1500]
     c = c[ c["count"] > 3]
 
-    outlier_df = df[df["visitId"].isin(c.index)]
+    outlier_df = log.filter_cases(c.index)._df
 
     st.markdown ("## Timebased Outliers: ")
     st.write("Duration (in ms) divided by the activity count. If this value is lower than 1500 the trace is potentially anomaly:")
     st.write(c.index)
 
     file_name = "timebased_outliers_"+file_name
-    outlier_df.to_csv(Path("./data/processed") /file_name)
+    io.save_data(outlier_df, file_name, "processed")
+
+
+@st.cache(allow_output_mutation=True, show_spinner=False)
+def get_variant_distances(codes: np.ndarray, lengths: np.ndarray, max_distance: int):
+    """
+    Sparse edit distances (within max_distance) between the variants of a log, cached per variants and max_distance
+    """
+    return pairwise_edit_distances(codes, lengths, max_distance=max_distance, damerau=True, as_sparse=True)
+
+
+def edit_distance_outlier_scores(sessions: EventLog, max_distance: int, min_cluster_size: int,
+                                 min_samples: int) -> np.ndarray:
+    """
+    HDBSCAN outlier scores of the sessions on their edit distances. The distances only depend on the activity
+    sequence, so they are computed per variant; a variant is clustered as min(count, min_cluster_size) points.
+    """
+    variants = sessions.variants
+    codes, lengths = pad_codes(variants)
+    with st.spinner("Computing edit distances ..."):
+        distances = get_variant_distances(codes, lengths, max_distance)
+    rows = variants.repeat_capped(min_cluster_size)
+    cluster = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples, cluster_selection_epsilon=0.5,
+                              metric='precomputed').fit(repeat_distances(distances, rows))
+    return variants.broadcast(cluster.outlier_scores_[np.searchsorted(rows, np.arange(len(variants)))])
+
+
+def get_outlier_model(sessions: EventLog, file_name: str, **params) -> OutlierModel:
+    """
+    Load the outlier model of a log or fit (and save) it if there is none with the same parameters
+    """
+    model_file = DATA_PATH_Models / f"{Path(file_name).stem}_outliers.model"
+    if model_file.exists():
+        model = OutlierModel.load(model_file)
+        if model.params == OutlierModel(**params).params and model.is_fitted_on(sessions):
+            return model
+    with st.spinner("Clustering sessions ..."):
+        model = OutlierModel(**params).fit(sessions)
+    model_file.parent.mkdir(parents=True, exist_ok=True)
+    model.save(model_file)
+    return model
+
+
+def score_new_sessions(model: OutlierModel, attr_mapping) -> None:
+    file_name = st.selectbox("Sessions to score: ", options=io.get_available_datasets("interim"))
+    new_log = EventLog(read_processed_data(file_name)._df, **attr_mapping, ts_parse_params={})
+    scores = model.score(new_log)
+    outlier_ids = model.get_outliers(scores)
+    st.write(f"{len(outlier_ids)} outliers found in {len(scores)} sessions of {file_name}.")
+    st.write(scores.loc[outlier_ids])
+
 
 def main():
     available_files = io.get_available_datasets("interim")
@@ -84,18 +127,13 @@ def main():
     log = read_processed_data(file_name)
 
     attr_mapping = attribute_mapper.show(log._df.columns)
-    case_attr = attr_mapping['case_id_attr']
-    traces = filter_by_session_length(log._df, case_attr)
-    traces = traces.groupby(case_attr).apply(Trace, attrs=attr_mapping)
-   
+    sessions = EventLog(log._df, **attr_mapping, ts_parse_params={})
+    sessions = sessions.filter_cases(sessions.case_lengths > 1)
+    activities = sessions.vocabulary[sessions.activity_attr]
 
-    corpus = create_corpus(traces)
     show_corpus = st.checkbox("Show Corpus")
     if show_corpus:
-        st.write("Activities in Traces:", corpus)
-    # generate vectors from activities
-    vectors_ids, vectors, vector_max_len = vectorize_activities(traces, corpus)
-    matrix = create_np_matrix(vectors_ids, vector_max_len)
+        st.write("Activities in Traces:", activities)
 
     min_cluster_size = 4
     min_sample = 1
@@ -109,34 +147,41 @@ def main():
     min_cluster_size = {min_cluster_size}\n
     min_samples per cluster = {min_sample}""")
     
-
-    cluster = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_sample,
-    cluster_selection_epsilon=0.5).fit(matrix)
+    compare_by = st.selectbox("Compare sessions by: ", ['Hashed n-grams', 'Edit distance'])
+    if compare_by == 'Edit distance':
+        max_distance = st.slider("Max. edit distance: ", 1, 50, 10)
+        outlier_scores = edit_distance_outlier_scores(sessions, max_distance, min_cluster_size, min_sample)
+    else:
+        ngram_len = st.slider("Length of activity sequences (n-grams): ", 1, 5, 3)
+        model = get_outlier_model(sessions, file_name, n=ngram_len, n_features=N_FEATURES,
+                                  min_cluster_size=min_cluster_size, min_samples=min_sample)
+        outlier_scores = model.results['outlier_score'].to_numpy()
+        if st.checkbox("Score sessions of another log?"):
+            score_new_sessions(model, attr_mapping)
     """
         Outlierdetection: https://hdbscan.readthedocs.io/en/latest/outlier_detection.html
     """
     # "outlier_scores: ", cluster.outlier_scores_
     #sns.distplot(cluster.outlier_scores_[np.isfinite(cluster.outlier_scores_)], rug=True)
     #st.pyplot()
-    outliers = {}
-    outliers_list = []
-    for score, vector in zip(cluster.outlier_scores_, vectors.items()):
-        if score > 0.6:
-            outliers[vector[0]] = vector[1]
-            outliers_list.append(vector[0])
-            
+    # only the few outliers are decoded to their activities
+    outliers_list = [case_id for case_id, score in zip(sessions.case_index, outlier_scores)
+                     if score > OUTLIER_THRESHOLD]
+    outliers = {case_id: list(activities[trace.activity_codes])
+                for case_id, trace in sessions.get_traces_by_ids(outliers_list).items()}
+
     df = log._df
     outlier_df =df[df["visitId"].isin(outliers_list)]
 
     st.write(outlier_df)
     #log._df.to_csv(Path('./data/processed') / fout)
     file_name = "outliers_"+file_name
-    outlier_df.to_csv(Path("./data/processed") /file_name)
+    io.save_data(outlier_df, file_name, "processed")
 
     #write_outliers_to_pickle(outliers, file_name)
     outlier_trace_ids = [name for name in outliers.keys()]
 
-    st.write(f"{len(outlier_trace_ids)} outliers found in {len(traces)} Traces.")
+    st.write(f"{len(outlier_trace_ids)} outliers found in {len(sessions.case_index)} Traces.")
     show_outliers = st.checkbox("show a list of all outliers?")
     if show_outliers:
         st.write(outlier_trace_ids)
@@ -161,7 +206,7 @@ def main():
 
     # print (labels)
 
-    time_anomaly(log._df, file_name)
+    time_anomaly(sessions, file_name)
 
 
 if __name__ == "__main__":
@@ -10,9 +10,9 @@ from src.utils import io
 @st.cache
 def load_data(file_name: str, src_dir: str) -> pd.DataFrame:
     if str(src_dir) == 'raw':
-        return io.load_csv_data(file_name, src_dir, io.filter_dt_session)
+        return io.load_data(file_name, src_dir, io.filter_dt_session)
     else:
-        return io.load_csv_data(file_name, src_dir)
+        return io.load_data(file_name, src_dir)
 
 
 def select_file(src_dir: str, default: Optional[str] = None) -> Tuple[str, pd.DataFrame]:
@@ -211,7 +211,7 @@ def export_page_tree(fig: DotExporter, file_name: str) -> None:
 
 def load_data(file_name: str) -> pd.DataFrame:
     st.spinner("Loading data " + file_name)
-    df = io.load_csv_data(file_name)
+    df = io.load_data(file_name)
     st.write(f"Loaded {len(df)} entries")
     return df
 
@@ -231,8 +231,8 @@ def convert_to_eventlog(df: pd.DataFrame, rules: Ruleset, file_name: str) -> Non
     elog = convert_weblog(df, col_mapping, col_transformations, activity_attr='activity',
                           case_id_attr='visitId', timestamp_attr='starttime',
                           ts_parse_params={'unit': 'ms'})
-    dest_file = Path("./data/interim") / file_name
-    elog.export_to_csv(dest_file)
+    dest_file = Path("./data/interim") / Path(file_name).with_suffix('.parquet').name
+    elog.export(dest_file)
     st.text(f"Saved event log to {dest_file} ✔️")
 
 
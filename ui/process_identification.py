@@ -1,24 +1,28 @@
-from collections import Counter
-from functools import partial
-from typing import List, Tuple, Dict
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, NamedTuple, Tuple, Dict, Optional
 
 import altair as alt
-import markov_clustering as mcl
 import networkx as nx
+import numpy as np
 import nx_altair as nxa
 import pandas as pd
 import streamlit as st
+from scipy import sparse
 
 from src.event_log.eventlog import EventLog
-from src.pmtools.matrices import create_similarity_matrix
-from src.preprocessing.vectorize import create_corpus, vectorize_trace
+from src.pmtools import mcl
+from src.pmtools.matrices import create_knn_similarity_graph
+from src.preprocessing.vectorize import unique_rows, vectorize_traces
 from ui.components import attribute_mapper
 from ui.components.data_selector import select_file
 
 
 @st.cache(show_spinner=False)
-def cluster_with_markov(mat: pd.DataFrame, expansion: int, inflation: float) -> List:
-    result = mcl.run_mcl(mat, expansion=expansion, inflation=inflation, loop_value=0)
+def cluster_with_markov(mat: sparse.spmatrix, expansion: int, inflation: float,
+                        node_weights: Optional[np.ndarray] = None) -> List:
+    result = mcl.run_mcl(mat, expansion=expansion, inflation=inflation, loop_value=0, node_weights=node_weights)
     clusters = mcl.get_clusters(result)  # get clusters
 
     return clusters
@@ -39,63 +43,152 @@ def create_cluster_histogram(cluster_map: Dict) -> alt.Chart:
     return chart
 
 
-@st.cache(show_spinner=False)
-def draw_cluster(matrix, cluster_map: Dict) -> alt.Chart:
-    g = nx.Graph(matrix)
+class ClusterGraph(NamedTuple):
+    graph: sparse.csr_matrix  # similarities between the nodes
+    node_ids: pd.Index  # representative trace of every node
+    node_weights: np.ndarray  # number of traces of every node
+    node_clusters: np.ndarray  # cluster of every node
+
+
+def _strongest_edges(graph: sparse.spmatrix, edges_per_node: int) -> sparse.csr_matrix:
+    """
+    Keep the strongest edges of every node (and no self loops).
+    """
+    graph = sparse.csr_matrix(graph, copy=True)
+    graph.setdiag(0)
+    graph.eliminate_zeros()
+    counts = np.diff(graph.indptr)
+    if graph.nnz and counts.max() > edges_per_node:
+        rows = np.repeat(np.arange(graph.shape[0]), counts)
+        order = np.lexsort((-graph.data, rows))
+        rank = np.empty(graph.nnz, dtype=np.int64)
+        rank[order] = np.arange(graph.nnz) - np.repeat(graph.indptr[:-1], counts)
+        graph.data[rank >= edges_per_node] = 0
+        graph.eliminate_zeros()
+    return graph.maximum(graph.T).tocsr()
+
+
+def _collapse_clusters(cg: ClusterGraph) -> ClusterGraph:
+    """
+    Merge the nodes of every cluster into a single node, edges are the summed similarities between the clusters.
+    """
+    clusters, cluster_of_node = np.unique(cg.node_clusters, return_inverse=True)
+    membership = sparse.csr_matrix((np.ones(len(cluster_of_node)), (np.arange(len(cluster_of_node)), cluster_of_node)),
+                                   shape=(len(cluster_of_node), len(clusters)))
+    graph = (membership.T @ cg.graph @ membership).tocsr()
+    return ClusterGraph(graph, pd.Index([f"Cluster {c}" for c in clusters]),
+                        np.bincount(cluster_of_node, weights=cg.node_weights), clusters)
+
+
+def _limit_nodes(cg: ClusterGraph, max_nodes: int) -> ClusterGraph:
+    if len(cg.node_ids) <= max_nodes:
+        return cg
+    kept = np.sort(np.argsort(-cg.node_weights, kind='stable')[:max_nodes])
+    return ClusterGraph(cg.graph[kept][:, kept], cg.node_ids[kept], cg.node_weights[kept], cg.node_clusters[kept])
+
+
+def _limit_edges(graph: sparse.csr_matrix, max_edges: int) -> sparse.csr_matrix:
+    upper = sparse.triu(graph, k=1).tocoo()
+    if upper.nnz > max_edges:
+        kept = np.argsort(-upper.data, kind='stable')[:max_edges]
+        upper = sparse.coo_matrix((upper.data[kept], (upper.row[kept], upper.col[kept])), shape=graph.shape)
+    return upper.tocsr()
+
+
+_LAYOUT_CACHE_SIZE = 16
+_layouts: 'OrderedDict[str, Dict]' = OrderedDict()
+
+
+def _get_layout(g: nx.Graph, graph: sparse.csr_matrix, cg: ClusterGraph) -> Dict:
+    """
+    Spring layout of the reduced graph, cached per graph and cluster result.
+    """
+    h = hashlib.sha1()
+    for arr in (graph.indptr, graph.indices, graph.data, cg.node_weights, cg.node_clusters):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    key = h.hexdigest()
+    if key in _layouts:
+        _layouts.move_to_end(key)
+    else:
+        _layouts[key] = nx.spring_layout(g, seed=42)
+        if len(_layouts) > _LAYOUT_CACHE_SIZE:
+            _layouts.popitem(last=False)
+    return _layouts[key]
+
+
+def draw_cluster(cluster_graph: ClusterGraph, collapse_clusters: bool = False, edges_per_node: int = 3,
+                 max_nodes: int = 500, max_edges: int = 2000) -> alt.Chart:
+    """
+    Draw the similarity graph of the traces reduced to the strongest edges of every node.
+    :param cluster_graph: the (weighted) nodes of the traces, identical traces already being a single node
+    :param collapse_clusters: draw a node per cluster instead of per trace
+    :param edges_per_node: number of strongest edges kept per node
+    :param max_nodes: only draw the heaviest nodes
+    :param max_edges: only draw the strongest edges
+    """
+    cg = _collapse_clusters(cluster_graph) if collapse_clusters else cluster_graph
+    cg = _limit_nodes(cg._replace(graph=_strongest_edges(cg.graph, edges_per_node)), max_nodes)
+    graph = _limit_edges(cg.graph, max_edges)
+
+    g = nx.from_scipy_sparse_array(graph)
     # map node to cluster id for colors
-    for tid in g.nodes():
-        node = g.nodes[tid]
-        node['cluster'] = cluster_map[tid]
-        node['id'] = tid
+    for idx in g.nodes():
+        node = g.nodes[idx]
+        node['id'] = str(cg.node_ids[idx])
+        node['cluster'] = int(cg.node_clusters[idx])
+        node['traces'] = int(cg.node_weights[idx])
 
     # Compute positions for viz.
-    pos = nx.spring_layout(g, seed=42)
+    pos = _get_layout(g, graph, cg)
     # Draw the graph using Altair
     graph_viz = nxa.draw_networkx(g, pos=pos, node_color='cluster',
+                                  node_size='traces',
                                   cmap='Paired',  # category20 colormap = `tab20`
                                   edge_color='gainsboro',
-                                  node_tooltip=['cluster', 'id'])
+                                  node_tooltip=['cluster', 'id', 'traces'])
     return graph_viz
 
 
 @st.cache(show_spinner=False)
-def find_clusters(traces: pd.Series, expansion: int, inflation: float) -> Tuple[Dict, alt.Chart]:
-    corpus = create_corpus(traces)
-    trace2vec_fn = partial(vectorize_trace, corpus)
-    mat = create_similarity_matrix(corpus, traces, trace2vec_fn)
+def find_clusters(traces: pd.Series, expansion: int, inflation: float, n_neighbours: int = 10,
+                  min_similarity: float = 0.) -> Tuple[Dict, ClusterGraph]:
+    # traces with the same activity counts are a single (weighted) node
+    vectors, node_of_trace, node_weights = unique_rows(vectorize_traces(traces))
+    graph = create_knn_similarity_graph(vectors, k=n_neighbours, min_similarity=min_similarity)
 
-    clusters = cluster_with_markov(mat, expansion, inflation)
-    cluster_map = {traces.index[node]: i + 1 for i, cluster in enumerate(clusters) for node in cluster}
-    graph_viz = draw_cluster(mat, cluster_map)
-    return cluster_map, graph_viz
+    # like the full similarity matrix every trace is similar to itself, so also isolated traces form a cluster
+    clusters = cluster_with_markov(graph + sparse.identity(graph.shape[0], format='csr'), expansion, inflation,
+                                   node_weights)
+    node_cluster = np.zeros(graph.shape[0], dtype=int)
+    for i, cluster in enumerate(clusters):
+        node_cluster[list(cluster)] = i + 1
+    cluster_map = dict(zip(traces.index, node_cluster[node_of_trace].tolist()))
+    node_ids = traces.index[np.unique(node_of_trace, return_index=True)[1]]
+    return cluster_map, ClusterGraph(graph, node_ids, node_weights, node_cluster)
 
 
 def inspect_traces(traces: pd.Series) -> None:
     st.subheader("Inspect trace")
 
     if st.checkbox("Search by cluster index", value=True):
-        trace_idx = st.number_input("Trace number: ", min_value=0, value=0, max_value=len(traces))
-        st.write(traces[trace_idx])
+        trace_idx = st.number_input("Trace number: ", min_value=0, value=0, max_value=len(traces) - 1)
+        st.write(traces.iloc[trace_idx])
     else:
-        trace_id = st.selectbox("Trace Id:", sorted([t.id for t in traces]))
+        trace_id = st.selectbox("Trace Id:", sorted(traces.index))
         st.text("searching for " + trace_id)
-        # trace = log.get_trace(trace_id)
-        trace = next(t for t in traces if t.id == trace_id)
-        st.write(trace)
-
-        for i, t in enumerate(traces):
-            if t.id == trace.id:
-                st.text(f"Index of selected trace: {i}")
+        trace_idx = traces.index.get_loc(trace_id)
+        st.write(traces.iloc[trace_idx])
+        st.text(f"Index of selected trace: {trace_idx}")
 
 
 @st.cache(show_spinner=False)
-def create_cluster_activities_graph(selected_cluster: List) -> alt.Chart:
-    act_count = Counter()
-    for activities in selected_cluster:
-        # trace = traces[trace_id]
-        act_count.update(activities)
+def create_cluster_activities_graph(selected_cluster: List, activities: pd.Index) -> alt.Chart:
+    codes = np.concatenate(selected_cluster) if selected_cluster else np.zeros(0, dtype=int)
+    act_count = np.bincount(codes[codes >= 0], minlength=len(activities))
+    occurring = act_count > 0
 
-    df = pd.DataFrame({"Activity": list(act_count.keys()), "Count": list(act_count.values())})
+    # decode activities only for display
+    df = pd.DataFrame({"Activity": activities[occurring], "Count": act_count[occurring]})
     chart = alt.Chart(df, padding={"top": 5}, height=500).mark_bar().encode(
         alt.X("Activity", axis=alt.Axis(labelAngle=0)),
         alt.Y("Count"),
@@ -107,13 +200,13 @@ def create_cluster_activities_graph(selected_cluster: List) -> alt.Chart:
     return chart
 
 
-def inspect_clusters(clusters: Dict, traces) -> None:
+def inspect_clusters(clusters: Dict, traces, activities: pd.Index) -> None:
     # analyze number of different activities in selected cluster
     no_clusters = len(set(clusters.values()))
     cluster_id = st.number_input("Cluster ", min_value=1, value=1, max_value=no_clusters)
-    selected_cluster = [traces[tid].activities for tid, cid in clusters.items() if cid == cluster_id]
+    selected_cluster = [traces[tid].activity_codes for tid, cid in clusters.items() if cid == cluster_id]
     st.write(f"Cluster {cluster_id} has {len(selected_cluster)} traces associated")
-    chart = create_cluster_activities_graph(selected_cluster)
+    chart = create_cluster_activities_graph(selected_cluster, activities)
     st.altair_chart(chart)
 
 
@@ -125,8 +218,8 @@ def save_clusters(log: EventLog, cluster_map: Dict, file_name: str) -> None:
     :param file_name:
     """
     log.set_clusters(cluster_map)
-    fout = file_name.replace('.csv', '_clustered.csv')
-    log.export_to_csv(f"./data/processed/{fout}")
+    fout = Path(file_name).stem + '_clustered.parquet'
+    log.export(f"./data/processed/{fout}")
     st.text(f"Saved log file with cluster info to {fout}")
 
 
@@ -134,14 +227,19 @@ def main():
     file_name, df = select_file('interim', default='dt_sessions_1k.csv')
     attr_mapping = attribute_mapper.show(df.columns)
     log = EventLog(df, **attr_mapping, ts_parse_params={})
-    traces = log.get_traces(lambda t: t.str.len() > 1)
+    traces = log.filter_cases(log.case_lengths > 1).traces
 
     st.header("Cluster traces")
     expansion = st.slider("Expansion", min_value=2, max_value=100)
     inflation = st.slider("inflation", min_value=2., max_value=100.)
+    n_neighbours = st.slider("Number of most similar traces", min_value=1, max_value=100, value=10)
+    min_similarity = st.slider("Min. similarity", min_value=0., max_value=1., value=0.)
     with st.spinner("Traces are being clusters - please be patient 😴 ..."):
-        clusters, graph_viz = find_clusters(traces, expansion, inflation)
-        st.altair_chart(graph_viz)
+        clusters, cluster_graph = find_clusters(traces, expansion, inflation, n_neighbours, min_similarity)
+        collapse = st.checkbox("Show clusters as single nodes?")
+        edges_per_node = st.slider("Edges per node", min_value=1, max_value=20, value=3)
+        max_nodes = st.slider("Max. number of nodes", min_value=10, max_value=5000, value=500)
+        st.altair_chart(draw_cluster(cluster_graph, collapse, edges_per_node, max_nodes))
         chart = create_cluster_histogram(clusters)
         st.altair_chart(chart)
     st.write(f"{len(set(clusters.values()))} clusters identified")
@@ -150,7 +248,7 @@ def main():
         inspect_traces(traces)
 
     st.header("Inspect cluster")
-    inspect_clusters(clusters, traces)
+    inspect_clusters(clusters, traces, log.vocabulary[log.activity_attr])
 
     st.markdown('------')
     cli_mode = not st._is_running_with_streamlit
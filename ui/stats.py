@@ -6,14 +6,14 @@ from ui.components import attribute_mapper
 from ui.components.data_selector import select_file
 from ui.trufflehunter import show_dotted_chart
 from src.event_log.eventlog import EventLog
-from src.utils.io import load_csv_data
+from src.pmtools import parallel
+from src.utils.io import load_data
 
 URL = 'path'
 
-def time_boxplot(df):
+def time_boxplot(features: pd.DataFrame):
 
-    df = df.groupby("visitId").agg({"duration": ["sum"]})
-    df = df.groupby("visitId").apply(lambda x: x["duration"].sum()/60)
+    df = (features[["total_duration"]] / 1000).rename(columns={"total_duration": "sum"})
 
     st.write("longest Traces in seconds", df.sort_values(by="sum", ascending = False).head(5))
     
@@ -24,10 +24,8 @@ def time_boxplot(df):
     ).properties(title= "Duration of Traces")
 
 # umbauen auf eventlog -> dottet chart with activities
-def stats(df, threshold = 2):
+def stats(log: EventLog, threshold = 2):
     #st.write(df.columns)
-    visit_id = df["visitId"].value_counts().sort_values(ascending = False)
-    visit_id = visit_id.rename(columns = { "visitId" : "TraceId" } )
     
     #df_trace_size_smaler_th = df[df.groupby('visitId')['visitId'].transform('count').lt(threshold)]
 
@@ -38,18 +36,22 @@ def stats(df, threshold = 2):
 
     # {df_trace_size_smaler_th.shape[0]} lines are removed cause the Trace length is smaller than the Threshhold {threshold}.
     # """)
-    df = df[df.groupby('visitId')['visitId'].transform('count').gt(threshold)]
-    visit_id = df["visitId"].value_counts().sort_values(ascending = False)
+    features = parallel.get_case_features(log)
+    keep = features["events"].to_numpy() > threshold
+    log = log.filter_cases(keep)
+    features = features[keep]
+    df = log._df
+    visit_id = features["events"].sort_values(ascending = False)
     st.markdown('---')
     
     #st.write("Traces Summary(visitID):", visit_id.describe())
     st.write("First 5 Lines:", df.head())
     
     st.markdown("## Sessions with the most Requests:")
-    st.write( alt.Chart(visit_id.reset_index().head()) \
+    st.write( alt.Chart(pd.DataFrame({"Trace": visit_id.index[:5].astype(str), "Requests": visit_id.to_numpy()[:5]})) \
                         .mark_bar().encode(
-        x = "visitId:Q",
-        y = "index:N"
+        x = "Requests:Q",
+        y = "Trace:N"
     ) ) 
 
     longest_trace = visit_id.head().keys()
@@ -71,11 +73,11 @@ def stats(df, threshold = 2):
     # show_dotted_chart(dotted_log)
     
     if show_table:
-        st.table( df[ df.visitId.str.contains( options )])
+        st.table(log.get_case_events(options))
 
     st.markdown ("## Duration: ")
     #st.write("Traces Summary:", df.describe())
-    st.write(time_boxplot(df))
+    st.write(time_boxplot(features))
     
     st.markdown ("## Top 10 requested Paths: ")
     st.write(f"the log contains {df[URL].nunique()} different Urls.")
@@ -87,10 +89,12 @@ def main():
     #file_name, df = select_file(option)
     file_name, df = select_file("interim")
     attr_mapping = attribute_mapper.show(df.columns)
-    # df = load_csv_data("first30k.csv")
+    # df = load_data("first30k.csv")
     #df = df.set_index("Unnamed: 0")
 
-    stats(df)
+    log = EventLog(df, **attr_mapping, ts_parse_params={})
+
+    stats(log)
 
 
 # disco stats page als vorbild
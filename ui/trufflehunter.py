@@ -12,9 +12,9 @@ import altair as alt
 from src.visualization import visualization as visu
 from src.pmtools import matrices
 from src.event_log.eventlog import EventLog
+from src.event_log.writer import XesWriter
 from src.miners import AlphaMiner
 from src.utils import io
-from pm4py.objects.log.exporter.xes import factory as xes_exporter
 from pm4py.visualization.petrinet import factory as pn_vis_factory
 
 
@@ -37,31 +37,42 @@ from ui.components.data_selector import select_file
 #     return log
 
 
-def export_log_file(log_file, file_path: Path):
-    xes_file = file_path.with_suffix('.xes')
-    xes_exporter.export_log(log_file, str(xes_file))
+def export_log_file(log_file: EventLog, file_path: Path, compress: bool = False):
+    xes_file = file_path.with_suffix('.xes.gz' if compress else '.xes')
+    XesWriter(compress=compress).write(log_file, xes_file)
 
 
 def show_dotted_chart(log: EventLog) -> None:
-    df = log._df.copy()
-    st.write(df)
-    #start_times = df.sort_values([log.ts_attr, log.case_id_attr]).groupby(by=log.case_id_attr).first()
-    # add information about duration of case for every event
-    #df['Duration'] = (df[log.ts_attr] - start_times.loc[df[log.case_id_attr]][log.ts_attr].values) / np.timedelta64(1, 'm')
-
-    # TODO x-axis attribute: trace start-time (-> investigate case duration time), timestamp
-    # TODO sorting traces (by duration of trace, case id, etc.)
-
     st.sidebar.title('Settings')
-    col_attr = st.sidebar.selectbox('Color Attribute:', df.columns, 5)
+    columns = list(log._event_columns)
+    col_attr = st.sidebar.selectbox('Color Attribute:', columns, min(5, len(columns) - 1))
     x_attr = st.sidebar.selectbox('X-Axis:', [log.ts_attr, log.time_passed_attr], 0)
-    y_attr = st.sidebar.selectbox('Y-Axis:', [log.case_id_attr])
-    # y_sort = st.sidebar.selectbox('Sort Y-Axis:', [log.case_id_attr, log.ts_attr, 'Duration'])
+    case_order = st.sidebar.selectbox('Sort Cases by:', visu.CASE_ORDERS)
+
+    n_cases = len(log.case_index)
+    st.text(f"Loaded {n_cases} cases with a total of {len(log)} events")
+
+    # zoom: large ranges are shown as buckets, small ones as single events
+    x_values = log.get_column(x_attr)
+    x_min, x_max = x_values.min(), x_values.max()
+    if x_attr == log.ts_attr:
+        x_min, x_max = x_min.to_pydatetime(), x_max.to_pydatetime()
+    else:
+        x_min, x_max = float(x_min), float(x_max)
+    x_range = st.sidebar.slider('X-Axis Range:', x_min, x_max, (x_min, x_max)) if x_min < x_max else None
+    case_range = st.sidebar.slider('Cases (rank):', 0, n_cases - 1, (0, n_cases - 1)) if n_cases > 1 else None
+    max_points = st.sidebar.number_input('Max. Events shown as Points:', 100, 50_000, 5000, step=1000)
 
-    st.text(f"Loaded {len(df[log.case_id_attr].unique())} cases with a total of {len(df)} events")
-    # tooltip = ['Activity', 'Timestamp', 'Resource', 'Costs']
     tooltip = [log.case_id_attr, log.activity_attr, log.ts_attr, 'path']
-    st.altair_chart(create_dotted_chart(df, col_attr, x_attr, y_attr, x_attr, tooltip=tooltip), width=-1)
+    df, binned = visu.create_dotted_chart_data(log, col_attr, x_attr, case_order, x_range=x_range,
+                                               case_range=case_range, max_points=max_points,
+                                               columns=[c for c in tooltip if c in columns])
+    if binned:
+        st.text(f"Too many events in the selected range, showing {len(df)} buckets instead (zoom in for events)")
+        st.altair_chart(visu.create_binned_dotted_chart(df, col_attr, x_attr), width=-1)
+    else:
+        tooltip = [c for c in tooltip if c in df.columns]
+        st.altair_chart(create_dotted_chart(df, col_attr, x_attr, 'case_rank', 'case_rank', tooltip=tooltip), width=-1)
 
 
 def load_all_processed_data():
@@ -69,7 +80,7 @@ def load_all_processed_data():
 
     data = []
     for av_file in available_files:
-        df = io.load_csv_data(av_file, "processed")
+        df = io.load_data(av_file, "processed", columns=("visitId",))
         df["source"] = av_file
         data.append(df)
 
@@ -136,8 +147,14 @@ def mine_process(log) -> Optional[alt.Chart]:
         if visu_type == 'Petri Net':
             return pn_vis_factory.apply(net, start_mark, end_mark)
         elif visu_type == 'Directly Follows Graph':
-            mat = matrices.create_heuristic_matrix(log)
-            return visu.create_directly_follows_graph(mat)
+            n_edges = int((matrices.create_heuristic_matrix(log).to_numpy() > 0).sum())
+            top_k = st.slider("Max. number of edges:", 1, max(n_edges, 1), min(n_edges, 50) or 1)
+            min_dependency = st.slider("Min. dependency (percentile):", 0, 100, 0)
+            min_frequency = st.slider("Min. edge frequency (percentile):", 0, 100, 0)
+            min_activity = st.slider("Min. activity frequency (percentile):", 0, 100, 0)
+            return visu.create_filtered_directly_follows_graph(log, top_k=top_k, min_dependency_pct=min_dependency,
+                                                               min_frequency_pct=min_frequency,
+                                                               min_activity_pct=min_activity)
     return None
 
 